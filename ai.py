@@ -1,25 +1,46 @@
 #!/usr/bin/env python3
 """
 Stable Telegram Upload+View Bot — webhook variant for Render (single-file)
-- No polling. Uses webhooks.
+- Uses webhooks by default; TRANSPORT=polling long-polls getUpdates instead
+  (self-hosted, no public HTTPS) and feeds the same update workers.
 - Runs Telegram Application and Quart (ASGI) in the same asyncio loop via Hypercorn.
 - Fixed for Python 3.13 compatibility
+- WEB_WORKERS > 1 forks that many processes sharing one listening socket; upload
+  sessions and conversation states then live in SQLite instead of process memory,
+  and each user's updates are run one at a time, in order, across all workers
 """
 
 import os
+import json
+import re
 import time
+import hmac
+import hashlib
 import logging
 import secrets
+import signal
+import socket
 import sqlite3
+import multiprocessing
+import multiprocessing.connection
+import threading
+import queue
+from collections import OrderedDict, deque
 import urllib.parse
 import asyncio
-from typing import Dict, Any, Optional
+import functools
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Deque, Dict, Any, Callable, Hashable, Iterator, List, Optional, Tuple, TypeVar
 
 from quart import Quart, request
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InputMediaDocument,
     InputMediaPhoto,
     InputMediaVideo,
 )
@@ -30,10 +51,19 @@ from telegram.ext import (
     ContextTypes,
     CallbackQueryHandler,
     ConversationHandler,
+    ApplicationHandlerStop,
+    BaseHandler,
+    BaseRateLimiter,
+    TypeHandler,
     filters,
 )
+from telegram.error import RetryAfter
 import aiohttp
-from hypercorn.config import Config
+try:
+    import orjson  # optional: faster webhook body decoding (pip install orjson)
+except ImportError:
+    orjson = None
+from hypercorn.config import Config as HypercornConfig
 from hypercorn.asyncio import serve
 
 
@@ -47,9 +77,40 @@ if not UPLOAD_BOT_TOKEN:
     raise RuntimeError("UPLOAD_BOT_TOKEN must be provided in environment")
 
 MAIN_CHANNEL_ID = os.environ.get("MAIN_CHANNEL_ID", "-1003104322226").strip()
+# optional private channel that gets a copy of every upload; views are then served with copyMessages
+STORAGE_CHANNEL_ID = os.environ.get("STORAGE_CHANNEL_ID", "").strip()
 PASSWORD = os.environ.get("UPLOAD_PASSWORD", "test")
 PASSWORD_VALID_SECONDS = int(os.environ.get("PASSWORD_VALID_SECONDS", 24 * 3600))
 DB_PATH = os.environ.get("DB_PATH", "tg_content.db")
+DB_POOL_READERS = int(os.environ.get("DB_POOL_READERS", 4))
+# SQLite performance profile (applied by init_db and to every pooled connection)
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "WAL").strip().upper()
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL").strip().upper()
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
+DB_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", -16000))  # negative = KiB
+DB_TEMP_STORE = os.environ.get("DB_TEMP_STORE", "MEMORY").strip().upper()
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 30000))
+DB_CHECKPOINT_SECONDS = int(os.environ.get("DB_CHECKPOINT_SECONDS", 300))
+# threads that run blocking sqlite reads off the event loop; writes get their own single thread
+DB_EXECUTOR_THREADS = int(os.environ.get("DB_EXECUTOR_THREADS", DB_POOL_READERS))
+# group commit for non-critical (audit-style) writes
+WRITE_BEHIND_INTERVAL_MS = int(os.environ.get("WRITE_BEHIND_INTERVAL_MS", 50))
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get("WRITE_BEHIND_MAX_BATCH", 200))
+# web worker processes sharing the listening socket (1 = everything in this process)
+WEB_WORKERS = max(1, int(os.environ.get("WEB_WORKERS", 1)))
+# where upload sessions and conversation states live: "memory" or "sqlite" (required for WEB_WORKERS > 1)
+SESSION_STORE = os.environ.get("SESSION_STORE", "sqlite" if WEB_WORKERS > 1 else "memory").strip().lower()
+# in-process cache in front of get_content (deep-link views)
+CONTENT_CACHE_SIZE = int(os.environ.get("CONTENT_CACHE_SIZE", 1024))
+CONTENT_CACHE_TTL = int(os.environ.get("CONTENT_CACHE_TTL", 600))
+DELIVERY_CACHE_SIZE = int(os.environ.get("DELIVERY_CACHE_SIZE", 256))
+# write-through cache of VIP flag + last password auth per user (TTL 0 = entries never expire;
+# with several workers a write only reaches its own worker's cache, so the default TTL is short)
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 30 if WEB_WORKERS > 1 else 0))
+# chunked (online) schema migrations: rows per batch and pause between batches
+MIGRATION_CHUNK_ROWS = int(os.environ.get("MIGRATION_CHUNK_ROWS", 5000))
+MIGRATION_CHUNK_PAUSE_MS = int(os.environ.get("MIGRATION_CHUNK_PAUSE_MS", 50))
 ADMIN_IDS = [int(x) for x in os.environ.get("ADMIN_IDS", "").split(",") if x.strip().isdigit()]
 
 EXEIO_API_KEY = os.environ.get("EXEIO_API_KEY", "").strip()
@@ -59,9 +120,62 @@ RENDER_EXTERNAL_HOSTNAME = os.environ.get("RENDER_EXTERNAL_HOSTNAME", "").strip(
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").strip()
 PORT = int(os.environ.get("PORT", 8080))
 SET_WEBHOOK = os.environ.get("SET_WEBHOOK", "1").strip() == "1"
+# "webhook": Telegram pushes updates to TELEGRAM_WEBHOOK_PATH; "polling": long-poll getUpdates
+TRANSPORT = os.environ.get("TRANSPORT", "webhook").strip().lower()
+if TRANSPORT not in ("webhook", "polling"):
+    raise RuntimeError(f"TRANSPORT must be webhook or polling (got {TRANSPORT!r})")
+if TRANSPORT == "polling" and WEB_WORKERS > 1:
+    raise RuntimeError("TRANSPORT=polling needs WEB_WORKERS=1; Telegram allows one getUpdates consumer")
+POLL_LIMIT = int(os.environ.get("POLL_LIMIT", 100))  # updates per getUpdates call (Telegram caps it at 100)
+POLL_TIMEOUT = int(os.environ.get("POLL_TIMEOUT", 30))  # long-poll seconds
+POLL_RETRY_SECONDS = float(os.environ.get("POLL_RETRY_SECONDS", 3))
+# webhook acks as soon as an update is queued; these workers run the handlers
+# (different users concurrently, each user's updates strictly in order)
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", 8))
+UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", 1000))
+UPDATE_DRAIN_TIMEOUT = float(os.environ.get("UPDATE_DRAIN_TIMEOUT", 30))
+# admission limits: a class is shed once the queue holds this many updates
+# (UPDATE_QUEUE_SIZE caps callbacks/deep links, the others are shed earlier)
+UPDATE_NORMAL_LIMIT = int(os.environ.get("UPDATE_NORMAL_LIMIT", UPDATE_QUEUE_SIZE * 8 // 10))
+UPDATE_BULK_LIMIT = int(os.environ.get("UPDATE_BULK_LIMIT", UPDATE_QUEUE_SIZE // 2))
+# "reply": ack shed updates and tell the user to retry; "retry": answer 503 so Telegram redelivers later
+UPDATE_SHED_MODE = os.environ.get("UPDATE_SHED_MODE", "reply").strip().lower()
+UPDATE_BUSY_REPLIES_MAX = int(os.environ.get("UPDATE_BUSY_REPLIES_MAX", 50))
+# WEB_WORKERS > 1: a worker's claim on its queued updates lapses this long after the worker dies
+UPDATE_ORDER_LEASE_SECONDS = float(os.environ.get("UPDATE_ORDER_LEASE_SECONDS", 60))
+# how many recent update_ids are remembered to drop Telegram's re-deliveries
+UPDATE_DEDUP_WINDOW = int(os.environ.get("UPDATE_DEDUP_WINDOW", 4096))
+# outbound Bot API budgets (Telegram: ~30 msg/s overall, ~1 msg/s per chat, 20 msg/min per group/channel).
+# Buckets are per process: with WEB_WORKERS > 1 each worker gets OVERALL and GROUP_PER_MIN / WEB_WORKERS.
+# The per-chat budget is not split; a user's updates run on one worker at a time.
+RATE_LIMIT = os.environ.get("RATE_LIMIT", "1").strip() != "0"
+RATE_LIMIT_OVERALL = float(os.environ.get("RATE_LIMIT_OVERALL", 30))
+RATE_LIMIT_CHAT = float(os.environ.get("RATE_LIMIT_CHAT", 1))
+RATE_LIMIT_CHAT_BURST = int(os.environ.get("RATE_LIMIT_CHAT_BURST", 3))
+RATE_LIMIT_GROUP_PER_MIN = float(os.environ.get("RATE_LIMIT_GROUP_PER_MIN", 20))
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", 3))
+
+# update types with a registered handler; everything else is dropped before Update.de_json
+HANDLED_UPDATE_TYPES = ("message", "callback_query")
 
 # webhook path uses bot id as secret-ish path piece
 TELEGRAM_WEBHOOK_PATH = f"/webhook/{UPLOAD_BOT_TOKEN.split(':')[0]}"
+# sent by Telegram in X-Telegram-Bot-Api-Secret-Token; defaults to a value derived from the
+# bot token, so every worker and restart agrees on it. The default is only usable when
+# set_webhook_if_needed registers it; otherwise Telegram would never send it and every
+# update would get a 403, so that setup has to name the registered secret explicitly.
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "").strip() or hashlib.sha256(
+    f"webhook-secret:{UPLOAD_BOT_TOKEN}".encode()).hexdigest()
+if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+    raise RuntimeError("WEBHOOK_SECRET must be 1-256 characters of A-Z, a-z, 0-9, _ and -")
+if (TRANSPORT == "webhook" and not os.environ.get("WEBHOOK_SECRET", "").strip()
+        and not (SET_WEBHOOK and (WEBHOOK_URL or RENDER_EXTERNAL_HOSTNAME))):
+    raise RuntimeError(
+        "This process does not register the webhook (SET_WEBHOOK=0, or neither WEBHOOK_URL nor "
+        "RENDER_EXTERNAL_HOSTNAME is set), so Telegram will not send the derived secret token and "
+        "every update would be rejected. Set WEBHOOK_SECRET to the secret_token the webhook was "
+        "registered with."
+    )
 
 # content protection toggle
 content_protection = os.environ.get("CONTENT_PROTECTION", "1").strip() != "0"
@@ -80,26 +194,418 @@ content_protection = os.environ.get("CONTENT_PROTECTION", "1").strip() != "0"
     STATE_CONFIRM_TOKEN,
 ) = range(8)
 
-sessions: Dict[int, Dict[str, Any]] = {}
-
 # ------------------------------
 # LOGGING
 # ------------------------------
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ------------------------------
+# DB connection pool
+# ------------------------------
+_JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+_TEMP_STORES = ("DEFAULT", "FILE", "MEMORY")
+
+def _pragma_choice(name: str, value: str, allowed: Tuple[str, ...]) -> str:
+    if value not in allowed:
+        raise RuntimeError(f"{name} must be one of {', '.join(allowed)} (got {value!r})")
+    return value
+
+def apply_connection_pragmas(conn: sqlite3.Connection) -> None:
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA synchronous = {_pragma_choice('DB_SYNCHRONOUS', DB_SYNCHRONOUS, _SYNCHRONOUS_MODES)}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = {DB_CACHE_SIZE}")
+    conn.execute(f"PRAGMA temp_store = {_pragma_choice('DB_TEMP_STORE', DB_TEMP_STORE, _TEMP_STORES)}")
+
+class DBPool:
+    # fixed set of reader connections plus one writer; the writer commits when its block exits
+
+    def __init__(self, path: str, readers: int = 4):
+        self.path = path
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._all: List[sqlite3.Connection] = []
+        for _ in range(max(1, readers)):
+            self._readers.put(self._connect())
+        self._writer = self._connect()
+        self._writer_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        apply_connection_pragmas(conn)
+        self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        with self._writer_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.rollback()
+                raise
+            self._writer.commit()
+
+    def close(self) -> None:
+        with self._writer_lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+
+_db_pool: Optional[DBPool] = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool() -> DBPool:
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = DBPool(DB_PATH, DB_POOL_READERS)
+    return _db_pool
+
+def close_db_pool() -> None:
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.close()
+            _db_pool = None
+
+# ------------------------------
+# Async DB access
+# ------------------------------
+T = TypeVar("T")
+_db_executor: Optional[ThreadPoolExecutor] = None
+_db_write_executor: Optional[ThreadPoolExecutor] = None
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=max(1, DB_EXECUTOR_THREADS), thread_name_prefix="db")
+    return _db_executor
+
+def get_db_write_executor() -> ThreadPoolExecutor:
+    global _db_write_executor
+    if _db_write_executor is None:
+        # one thread: there is one writer connection, so more would only wait on its lock
+        _db_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+    return _db_write_executor
+
+async def run_db(func: Callable[..., T], *args: Any) -> T:
+    # blocking DB helpers run on the DB executor so a busy lock never stalls the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(func, *args))
+
+async def run_db_write(func: Callable[..., T], *args: Any) -> T:
+    # helpers that take the writer: queued apart from reads, so a held write lock never delays a view
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_write_executor(), functools.partial(func, *args))
+
+def shutdown_db_executor() -> None:
+    global _db_executor, _db_write_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
+    if _db_write_executor is not None:
+        _db_write_executor.shutdown(wait=True)
+        _db_write_executor = None
+
+# ------------------------------
+# Write-behind queue
+# ------------------------------
+def execute_writes(batch: List[Tuple[str, tuple]]) -> None:
+    with get_db_pool().writer() as conn:
+        for sql, params in batch:
+            conn.execute(sql, params)
+
+def execute_writes_individually(batch: List[Tuple[str, tuple]]) -> int:
+    # fallback after a failed group commit: one transaction per row; returns the rows that failed
+    failed = 0
+    for sql, params in batch:
+        try:
+            with get_db_pool().writer() as conn:
+                conn.execute(sql, params)
+        except Exception:
+            failed += 1
+            logger.exception("Write-behind row failed: %s %r", sql, params)
+    return failed
+
+class WriteBehindQueue:
+    # group-commits writes that need not be durable before we reply;
+    # before start() / after stop() writes run synchronously
+
+    def __init__(self, interval_ms: int, max_batch: int):
+        self.interval = interval_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.rows_flushed = 0
+        self.flushes = 0
+        self.failed_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, sql: str, params: tuple) -> None:
+        if self._queue is None:
+            execute_writes([(sql, params)])
+            return
+        self._queue.put_nowait((sql, params))
+
+    async def stop(self) -> None:
+        if self._queue is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._queue = None
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            first = await self._queue.get()
+            stopping = first is None
+            batch = [] if stopping else [first]
+            if not stopping and self._queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.interval)
+            while not self._queue.empty() and (stopping or len(batch) < self.max_batch):
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Tuple[str, tuple]]) -> None:
+        started = time.perf_counter()
+        try:
+            await run_db_write(execute_writes, batch)
+            failed = 0
+        except Exception:
+            # one bad row must not take the unrelated rows of the group commit down with it
+            logger.warning("Write-behind group commit of %d rows failed; retrying row by row", len(batch), exc_info=True)
+            try:
+                failed = await run_db_write(execute_writes_individually, batch)
+            except Exception:
+                failed = len(batch)
+                logger.exception("Write-behind retry of %d rows failed", len(batch))
+        self.rows_flushed += len(batch) - failed
+        self.failed_rows += failed
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.depth,
+            "rows_flushed": self.rows_flushed,
+            "failed_rows": self.failed_rows,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
+
+write_behind = WriteBehindQueue(WRITE_BEHIND_INTERVAL_MS, WRITE_BEHIND_MAX_BATCH)
+
+# ------------------------------
+# Caches
+# ------------------------------
+class LRUCache:
+    # thread-safe LRU with optional TTL; put() takes the generation read before the DB load
+    # so a load racing with an edit cannot re-insert stale data
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at and expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Any, value: Any, generation: Optional[int] = None) -> None:
+        with self._lock:
+            if generation is None:
+                self.generation += 1
+            elif generation != self.generation:
+                return
+            expires_at = time.monotonic() + self.ttl if self.ttl else 0.0
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Any) -> None:
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+content_cache = LRUCache(CONTENT_CACHE_SIZE, CONTENT_CACHE_TTL)
+# delivery steps per (content_id, content_protection); see get_delivery. It caches the InputMedia
+# objects and arguments, not request bodies: PTB still serializes them on every send
+delivery_cache = LRUCache(DELIVERY_CACHE_SIZE, CONTENT_CACHE_TTL)
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# ------------------------------
+# Records
+# ------------------------------
+class _RecordCompat:
+    # record['field'] access for code written against the old dict rows
+    __slots__ = ()
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+@dataclass(frozen=True, slots=True)
+class MediaItem(_RecordCompat):
+    media_id: int
+    file_id: str
+    file_unique_id: str
+    media_type: str
+    is_forwarded: int
+
+@dataclass(frozen=True, slots=True)
+class Content(_RecordCompat):
+    content_id: int
+    uploader_id: int
+    thumb_file_id: Optional[str]
+    description: Optional[str]
+    is_text_only: int
+    requires_token: int
+    created_at: int
+    main_channel_message_id: Optional[int]
+    media_items: Tuple[MediaItem, ...]
+    storage_message_ids: Tuple[int, ...] = ()  # copy in STORAGE_CHANNEL_ID, in delivery order
+
+@dataclass(frozen=True, slots=True)
+class UserStatus(_RecordCompat):
+    user_id: int
+    last_auth: int
+    is_vip: bool
+    known: bool = True  # False when the user has no row in the users table
+
+    def auth_remaining(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        return max(0, int(PASSWORD_VALID_SECONDS - (now - self.last_auth)))
+
+    def is_authed(self, now: Optional[float] = None) -> bool:
+        if self.is_vip:
+            return True
+        if not self.known:
+            return False
+        now = time.time() if now is None else now
+        return (now - self.last_auth) <= PASSWORD_VALID_SECONDS
+
 # ------------------------------
 # DB helpers
 # ------------------------------
-def init_db() -> None:
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS users(
+SQL_GET_USER = "SELECT last_auth, is_vip FROM users WHERE user_id = ?"
+# one round trip: the content row repeated once per media item (or once with NULL media columns)
+SQL_GET_CONTENT = """SELECT c.content_id, c.uploader_id, c.thumb_file_id, c.description, c.is_text_only, c.requires_token,
+        c.created_at, c.main_channel_message_id, c.storage_message_ids,
+        m.media_id, m.file_id, m.file_unique_id, m.media_type, m.is_forwarded
+    FROM content c LEFT JOIN media_items m ON m.content_id = c.content_id
+    WHERE c.content_id = ? ORDER BY m.media_id ASC"""
+SQL_GET_TOKEN = "SELECT token,user_id,content_id,issued_at,expires_at FROM tokens WHERE token = ?"
+SQL_LATEST_TOKEN = "SELECT token,expires_at,is_used FROM tokens WHERE user_id = ? AND content_id = ? ORDER BY issued_at DESC LIMIT 1"
+
+# queries on the view path; each must be answered from an index, never a table scan
+HOT_QUERIES = (
+    (SQL_GET_USER, (0,)),
+    (SQL_GET_CONTENT, (0,)),
+    (SQL_GET_TOKEN, ("",)),
+    (SQL_LATEST_TOKEN, (0, 0)),
+)
+
+def check_hot_query_plans(conn: sqlite3.Connection) -> None:
+    # raise if a hot query does a full scan or sort
+    for sql, params in HOT_QUERIES:
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+            detail = row[-1]
+            if detail.startswith("SCAN") or "TEMP B-TREE" in detail:
+                raise RuntimeError(f"Hot query is not index-backed ({detail}): {sql}")
+
+# ------------------------------
+# Schema migrations
+# ------------------------------
+@dataclass(frozen=True)
+class Migration:
+    # apply: one transaction during init_db. chunk(conn, cursor): one batch after cursor,
+    # returns the next cursor or None; each batch commits and saves its cursor in settings
+    version: int
+    description: str
+    apply: Optional[Callable[[sqlite3.Connection], None]] = None
+    chunk: Optional[Callable[[sqlite3.Connection, int], Optional[int]]] = None
+
+def _m001_base_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("""CREATE TABLE IF NOT EXISTS users(
         user_id INTEGER PRIMARY KEY,
         last_auth INTEGER,
         is_vip INTEGER DEFAULT 0
     )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS content(
+    conn.execute("""CREATE TABLE IF NOT EXISTS content(
         content_id INTEGER PRIMARY KEY AUTOINCREMENT,
         uploader_id INTEGER,
         thumb_file_id TEXT,
@@ -109,7 +615,7 @@ def init_db() -> None:
         created_at INTEGER,
         main_channel_message_id INTEGER
     )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS media_items(
+    conn.execute("""CREATE TABLE IF NOT EXISTS media_items(
         media_id INTEGER PRIMARY KEY AUTOINCREMENT,
         content_id INTEGER,
         file_id TEXT,
@@ -117,7 +623,7 @@ def init_db() -> None:
         media_type TEXT,
         is_forwarded INTEGER DEFAULT 0
     )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS tokens(
+    conn.execute("""CREATE TABLE IF NOT EXISTS tokens(
         token TEXT PRIMARY KEY,
         user_id INTEGER,
         content_id INTEGER,
@@ -125,27 +631,185 @@ def init_db() -> None:
         expires_at INTEGER,
         is_used INTEGER DEFAULT 0
     )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS shortener_requests(
+    conn.execute("""CREATE TABLE IF NOT EXISTS shortener_requests(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         shortener_url TEXT,
         token TEXT,
         status TEXT
     )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS settings(
+    conn.execute("""CREATE TABLE IF NOT EXISTS settings(
         key TEXT PRIMARY KEY,
         value TEXT
     )""")
-    conn.commit()
-    conn.close()
+
+# (table, statement); the first is the covering index for handle_view_content's latest-token lookup
+VIEW_INDEXES: Tuple[Tuple[str, str], ...] = (
+    ("tokens", """CREATE INDEX IF NOT EXISTS idx_tokens_user_content
+        ON tokens(user_id, content_id, issued_at DESC, token, expires_at, is_used)"""),
+    ("media_items", "CREATE INDEX IF NOT EXISTS idx_media_items_content ON media_items(content_id, media_id)"),
+)
+
+def _table_is_large(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute(f"SELECT 1 FROM {table} LIMIT 1 OFFSET ?", (MIGRATION_CHUNK_ROWS,)).fetchone() is not None
+
+def _m002_view_indexes(conn: sqlite3.Connection) -> None:
+    # small tables are indexed right away; big ones are left to migration 6,
+    # which builds them after the server is up instead of blocking startup
+    for table, sql in VIEW_INDEXES:
+        if not _table_is_large(conn, table):
+            conn.execute(sql)
+
+def _m003_upload_sessions(conn: sqlite3.Connection) -> None:
+    # upload flow state shared by all web workers (SQLiteSessionStore)
+    conn.execute("""CREATE TABLE IF NOT EXISTS upload_sessions(
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at INTEGER
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS upload_session_media(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        data TEXT NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_upload_session_media_user ON upload_session_media(user_id, id)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS conversation_states(
+        conv_key TEXT PRIMARY KEY,
+        state INTEGER NOT NULL,
+        updated_at INTEGER
+    )""")
+
+def _m004_storage_messages(conn: sqlite3.Connection) -> None:
+    # comma-separated message ids of the content's copy in STORAGE_CHANNEL_ID;
+    # checked first, ALTER TABLE has no IF NOT EXISTS and the column may predate user_version
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(content)")}
+    if "storage_message_ids" not in columns:
+        conn.execute("ALTER TABLE content ADD COLUMN storage_message_ids TEXT")
+
+def _m005_update_order(conn: sqlite3.Connection) -> None:
+    # cross-worker per-user ordering of updates (SharedUpdateOrder)
+    conn.execute("""CREATE TABLE IF NOT EXISTS update_order(
+        update_id INTEGER PRIMARY KEY,
+        order_key TEXT NOT NULL,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_update_order_key ON update_order(order_key, update_id)")
+
+def _m006_build_view_indexes(conn: sqlite3.Connection, cursor: int) -> Optional[int]:
+    # one index per batch so the writer is released between builds; readers keep
+    # serving throughout (WAL), writers wait for the index being built.
+    # A no-op on databases where migration 2 already created them.
+    if cursor < len(VIEW_INDEXES):
+        conn.execute(VIEW_INDEXES[cursor][1])
+    return cursor + 1 if cursor + 1 < len(VIEW_INDEXES) else None
+
+# ordered by version; never edit a released step, append a new one instead.
+# Chunked steps hold back every later step until they finish, so keep them last.
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "base schema", apply=_m001_base_schema),
+    Migration(2, "covering indexes for token and media lookups", apply=_m002_view_indexes),
+    Migration(3, "shared upload sessions and conversation states", apply=_m003_upload_sessions),
+    Migration(4, "storage channel message ids per content", apply=_m004_storage_messages),
+    Migration(5, "cross-worker update ordering", apply=_m005_update_order),
+    Migration(6, "build view indexes deferred on large tables", chunk=_m006_build_view_indexes),
+)
+
+def get_schema_version() -> int:
+    with get_db_pool().reader() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _apply_migration(m: Migration) -> None:
+    with get_db_pool().writer() as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= m.version:
+            return
+        conn.execute("BEGIN")
+        m.apply(conn)
+        conn.execute(f"PRAGMA user_version = {m.version}")
+    logger.info("Applied migration %d: %s", m.version, m.description)
+
+def _run_migration_chunk(m: Migration) -> bool:
+    # one batch of a chunked step; True once the step is complete
+    key = f"migration:{m.version}:cursor"
+    with get_db_pool().writer() as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= m.version:
+            return True
+        conn.execute("BEGIN")
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        next_cursor = m.chunk(conn, int(row[0]) if row else 0)
+        if next_cursor is not None:
+            conn.execute("INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)", (key, str(next_cursor)))
+            return False
+        conn.execute("DELETE FROM settings WHERE key = ?", (key,))
+        conn.execute(f"PRAGMA user_version = {m.version}")
+    logger.info("Applied migration %d: %s", m.version, m.description)
+    return True
+
+def run_migrations() -> Optional[Migration]:
+    # one-shot steps in order; stops at the first chunked step and returns it (None when current)
+    version = get_schema_version()
+    for m in MIGRATIONS:
+        if m.version <= version:
+            continue
+        if m.chunk is not None:
+            return m
+        _apply_migration(m)
+    return None
+
+def verify_hot_query_plans() -> None:
+    # EXPLAIN does not refresh a stale schema, so ask the connection that ran the migrations
+    with get_db_pool().writer() as conn:
+        check_hot_query_plans(conn)
+
+async def run_online_migrations() -> None:
+    try:
+        version = await run_db(get_schema_version)
+        pending = [m for m in MIGRATIONS if m.version > version]
+        if not pending:
+            return
+        for m in pending:
+            if m.chunk is None:
+                await run_db_write(_apply_migration, m)
+                continue
+            logger.info("Running migration %d in chunks: %s", m.version, m.description)
+            while not await run_db_write(_run_migration_chunk, m):
+                await asyncio.sleep(MIGRATION_CHUNK_PAUSE_MS / 1000)
+        # on the DB executor: waiting for the writer here would stall the event loop
+        await run_db_write(verify_hot_query_plans)
+    except Exception:
+        logger.exception("Background schema migration failed")
+
+def init_db() -> None:
+    with get_db_pool().writer() as conn:
+        mode = conn.execute(f"PRAGMA journal_mode = {_pragma_choice('DB_JOURNAL_MODE', DB_JOURNAL_MODE, _JOURNAL_MODES)}").fetchone()[0]
+        if mode.upper() != DB_JOURNAL_MODE:
+            logger.warning("SQLite refused journal_mode=%s; running in %s", DB_JOURNAL_MODE, mode)
+    online = run_migrations()
+    if online is not None:
+        logger.info("Migration %d (%s) will run in the background", online.version, online.description)
+        return
+    verify_hot_query_plans()
+
+def checkpoint_wal() -> None:
+    if DB_JOURNAL_MODE != "WAL":
+        return
+    with get_db_pool().writer() as conn:
+        busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    if busy:
+        logger.info("WAL checkpoint incomplete (%d/%d frames); readers still active", checkpointed, log_frames)
+
+async def wal_checkpoint_loop() -> None:
+    while True:
+        await asyncio.sleep(DB_CHECKPOINT_SECONDS)
+        try:
+            await run_db_write(checkpoint_wal)
+        except Exception:
+            logger.exception("WAL checkpoint failed")
 
 def load_password_from_db():
     global PASSWORD
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=30)
-        c = conn.cursor()
-        c.execute("SELECT value FROM settings WHERE key = 'password'")
-        row = c.fetchone()
-        conn.close()
+        with get_db_pool().reader() as conn:
+            row = conn.execute("SELECT value FROM settings WHERE key = 'password'").fetchone()
         if row and row[0]:
             PASSWORD = row[0]
             logger.info("Loaded PASSWORD from DB.")
@@ -153,112 +817,133 @@ def load_password_from_db():
     except Exception:
         logger.exception("Failed to read password from DB; using env/default.")
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=30)
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)", ("password", PASSWORD))
-        conn.commit()
-        conn.close()
+        with get_db_pool().writer() as conn:
+            conn.execute("INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)", ("password", PASSWORD))
     except Exception:
         logger.exception("Failed to init password in DB.")
 
 def set_password_in_db(new_pass: str):
     global PASSWORD
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)", ("password", new_pass))
-    conn.commit()
-    conn.close()
+    with get_db_pool().writer() as conn:
+        conn.execute("INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)", ("password", new_pass))
     PASSWORD = new_pass
 
-def user_is_authed(user_id: int) -> bool:
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("SELECT last_auth, is_vip FROM users WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    if not row:
-        return False
-    last_auth, is_vip = row
-    if is_vip:
-        return True
-    return (time.time() - last_auth) <= PASSWORD_VALID_SECONDS
+def get_upload_password() -> str:
+    # read from settings so a /changepass on any worker applies everywhere
+    with get_db_pool().reader() as conn:
+        row = conn.execute("SELECT value FROM settings WHERE key = 'password'").fetchone()
+    return row[0] if row and row[0] else PASSWORD
 
-def set_user_auth(user_id: int):
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
+def _fetch_user_status(user_id: int) -> UserStatus:
+    generation = user_cache.generation
+    with get_db_pool().reader() as conn:
+        row = conn.execute(SQL_GET_USER, (user_id,)).fetchone()
+    if row:
+        status = UserStatus(user_id, row[0] or 0, bool(row[1]))
+    else:
+        status = UserStatus(user_id, 0, False, known=False)
+    user_cache.put(user_id, status, generation)
+    return status
+
+async def load_user_status(user_id: int) -> UserStatus:
+    # cache hits are served without leaving the event loop
+    status = user_cache.get(user_id)
+    if status is not None:
+        return status
+    return await run_db(_fetch_user_status, user_id)
+
+async def set_user_auth(user_id: int):
+    # cache updated now, DB row via the write-behind queue
+    status = await load_user_status(user_id)
     now = int(time.time())
-    c.execute("SELECT is_vip FROM users WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    is_vip = row[0] if row else 0
-    c.execute("INSERT OR REPLACE INTO users(user_id,last_auth,is_vip) VALUES(?,?,?)", (user_id, now, is_vip))
-    conn.commit()
-    conn.close()
+    user_cache.put(user_id, replace(status, last_auth=now, known=True))
+    write_behind.submit(
+        "INSERT INTO users(user_id,last_auth,is_vip) VALUES(?,?,0) "
+        "ON CONFLICT(user_id) DO UPDATE SET last_auth = excluded.last_auth",
+        (user_id, now),
+    )
 
 def set_user_vip(user_id: int, is_vip: int = 1):
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("SELECT last_auth FROM users WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    last_auth = row[0] if row else 0
-    c.execute("INSERT OR REPLACE INTO users(user_id,last_auth,is_vip) VALUES(?,?,?)", (user_id, last_auth, is_vip))
-    conn.commit()
-    conn.close()
-
-def save_content_to_db(uploader_id: int, thumb_file_id: str, description: str, is_text_only: int, requires_token: int) -> int:
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
+    with get_db_pool().writer() as conn:
+        conn.execute(
+            "INSERT INTO users(user_id,last_auth,is_vip) VALUES(?,0,?) "
+            "ON CONFLICT(user_id) DO UPDATE SET is_vip = excluded.is_vip",
+            (user_id, is_vip),
+        )
+    status = user_cache.get(user_id)
+    if status is not None:
+        user_cache.put(user_id, replace(status, is_vip=bool(is_vip), known=True))
+    else:
+        user_cache.invalidate(user_id)
+
+def commit_content(uploader_id: int, thumb_file_id: str, description: str, is_text_only: int, requires_token: int,
+                   media_list: List[Dict[str, Any]]) -> int:
+    # content row and its media items in one transaction; returns the content_id
     now = int(time.time())
-    c.execute("""INSERT INTO content(uploader_id, thumb_file_id, description, is_text_only, requires_token, created_at)
-                 VALUES(?,?,?,?,?,?)""", (uploader_id, thumb_file_id, description, is_text_only, requires_token, now))
-    content_id = c.lastrowid
-    conn.commit()
-    conn.close()
+    with get_db_pool().writer() as conn:
+        c = conn.execute("""INSERT INTO content(uploader_id, thumb_file_id, description, is_text_only, requires_token, created_at)
+                     VALUES(?,?,?,?,?,?)""", (uploader_id, thumb_file_id, description, is_text_only, requires_token, now))
+        content_id = c.lastrowid
+        conn.executemany(
+            """INSERT INTO media_items(content_id, file_id, file_unique_id, media_type, is_forwarded)
+               VALUES(?,?,?,?,?)""",
+            [(content_id, m["file_id"], m.get("file_unique_id", ""), m["media_type"], m.get("is_forwarded", 0)) for m in media_list],
+        )
     return content_id
 
-def add_media_item(content_id: int, file_id: str, file_unique_id: str, media_type: str, is_forwarded: int = 0):
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("""INSERT INTO media_items(content_id, file_id, file_unique_id, media_type, is_forwarded)
-                 VALUES(?,?,?,?,?)""", (content_id, file_id, file_unique_id, media_type, is_forwarded))
-    conn.commit()
-    conn.close()
-
-def get_content(content_id: int) -> Optional[Dict[str, Any]]:
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("SELECT content_id, uploader_id, thumb_file_id, description, is_text_only, requires_token, created_at, main_channel_message_id FROM content WHERE content_id = ?", (content_id,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
+def invalidate_content(content_id: int) -> None:
+    content_cache.invalidate(content_id)
+    for protect in (True, False):
+        delivery_cache.invalidate((content_id, protect))
+
+def set_storage_message_ids(content_id: int, message_ids: List[int]):
+    with get_db_pool().writer() as conn:
+        conn.execute("UPDATE content SET storage_message_ids = ? WHERE content_id = ?",
+                     (",".join(map(str, message_ids)), content_id))
+    invalidate_content(content_id)
+
+def set_main_channel_message_id(content_id: int, message_id: int):
+    with get_db_pool().writer() as conn:
+        conn.execute("UPDATE content SET main_channel_message_id = ? WHERE content_id = ?", (message_id, content_id))
+    invalidate_content(content_id)
+
+def _fetch_content(content_id: int) -> Optional["Content"]:
+    generation = content_cache.generation
+    with get_db_pool().reader() as conn:
+        rows = conn.execute(SQL_GET_CONTENT, (content_id,)).fetchall()
+    if not rows:
         return None
-    keys = ["content_id", "uploader_id", "thumb_file_id", "description", "is_text_only", "requires_token", "created_at", "main_channel_message_id"]
-    content = dict(zip(keys, row))
-    c.execute("SELECT media_id, file_id, file_unique_id, media_type, is_forwarded FROM media_items WHERE content_id = ? ORDER BY media_id ASC", (content_id,))
-    media_rows = c.fetchall()
-    content["media_items"] = [
-        {"media_id": r[0], "file_id": r[1], "file_unique_id": r[2], "media_type": r[3], "is_forwarded": r[4]} for r in media_rows
-    ]
-    conn.close()
+    media_items = tuple(MediaItem(*r[9:]) for r in rows if r[9] is not None)
+    storage_ids = tuple(int(x) for x in rows[0][8].split(",")) if rows[0][8] else ()
+    content = Content(*rows[0][:8], media_items, storage_ids)
+    content_cache.put(content_id, content, generation)
     return content
 
+def get_content(content_id: int) -> Optional["Content"]:
+    content = content_cache.get(content_id)
+    if content is not None:
+        return content
+    return _fetch_content(content_id)
+
+async def load_content(content_id: int) -> Optional["Content"]:
+    # cache hits are served without leaving the event loop
+    content = content_cache.get(content_id)
+    if content is not None:
+        return content
+    return await run_db(_fetch_content, content_id)
+
 def create_token_for_user(user_id: int, content_id: int) -> str:
     token = secrets.token_hex(4)
     now = int(time.time())
     expires = now + 24 * 3600
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("""INSERT OR REPLACE INTO tokens(token,user_id,content_id,issued_at,expires_at)
-                 VALUES(?,?,?,?,?)""", (token, user_id, content_id, now, expires))
-    conn.commit()
-    conn.close()
+    with get_db_pool().writer() as conn:
+        conn.execute("""INSERT OR REPLACE INTO tokens(token,user_id,content_id,issued_at,expires_at)
+                     VALUES(?,?,?,?,?)""", (token, user_id, content_id, now, expires))
     return token
 
 def get_valid_token(token: str) -> Optional[Dict[str, Any]]:
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("SELECT token,user_id,content_id,issued_at,expires_at FROM tokens WHERE token = ?", (token,))
-    row = c.fetchone()
-    conn.close()
+    with get_db_pool().reader() as conn:
+        row = conn.execute(SQL_GET_TOKEN, (token,)).fetchone()
     if not row:
         return None
     keys = ["token", "user_id", "content_id", "issued_at", "expires_at"]
@@ -268,19 +953,163 @@ def get_valid_token(token: str) -> Optional[Dict[str, Any]]:
         return None
     return data
 
+def get_latest_token(user_id: int, content_id: int) -> Optional[Tuple[str, int, int]]:
+    # (token, expires_at, is_used) of the user's newest token for this content
+    with get_db_pool().reader() as conn:
+        return conn.execute(SQL_LATEST_TOKEN, (user_id, content_id)).fetchone()
+
 def mark_token_used(token: str):
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("UPDATE tokens SET is_used = 1 WHERE token = ?", (token,))
-    conn.commit()
-    conn.close()
+    with get_db_pool().writer() as conn:
+        conn.execute("UPDATE tokens SET is_used = 1 WHERE token = ?", (token,))
 
 def record_shortener_request(short_url: str, token: str, status: str = "done"):
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("INSERT INTO shortener_requests(shortener_url, token, status) VALUES(?,?,?)", (short_url, token, status))
-    conn.commit()
-    conn.close()
+    write_behind.submit("INSERT INTO shortener_requests(shortener_url, token, status) VALUES(?,?,?)", (short_url, token, status))
+
+# ------------------------------
+# Upload sessions
+# ------------------------------
+def new_upload_session(user_id: int) -> Dict[str, Any]:
+    return {"uploader_id": user_id, "media_list": []}
+
+class MemorySessionStore:
+    # single web worker; get() returns a copy, changes stick only through update()/add_media()
+
+    def __init__(self):
+        self._sessions: Dict[int, Dict[str, Any]] = {}
+        self._states: Dict[str, int] = {}
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        return dict(session, media_list=list(session["media_list"]))
+
+    async def start(self, user_id: int) -> None:
+        self._sessions[user_id] = new_upload_session(user_id)
+
+    async def update(self, user_id: int, **fields: Any) -> None:
+        self._sessions.setdefault(user_id, new_upload_session(user_id)).update(fields)
+
+    async def add_media(self, user_id: int, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # None without an active session
+        if user_id not in self._sessions:
+            return None
+        self._sessions[user_id]["media_list"].append(item)
+        return await self.get(user_id)
+
+    async def discard(self, user_id: int) -> None:
+        self._sessions.pop(user_id, None)
+
+    async def get_state(self, key: str) -> Optional[int]:
+        return self._states.get(key)
+
+    async def set_state(self, key: str, state: Optional[int]) -> None:
+        if state is None:
+            self._states.pop(key, None)
+        else:
+            self._states[key] = state
+
+class SQLiteSessionStore:
+    # shared by all web workers; fields merged with json_patch, media one row per item
+
+    @staticmethod
+    def _load(conn: sqlite3.Connection, user_id: int) -> Optional[Dict[str, Any]]:
+        row = conn.execute("SELECT data FROM upload_sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        session = json.loads(row[0])
+        session["media_list"] = [
+            json.loads(r[0])
+            for r in conn.execute("SELECT data FROM upload_session_media WHERE user_id = ? ORDER BY id", (user_id,))
+        ]
+        return session
+
+    def _get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with get_db_pool().reader() as conn:
+            return self._load(conn, user_id)
+
+    def _start(self, user_id: int) -> None:
+        session = new_upload_session(user_id)
+        del session["media_list"]
+        with get_db_pool().writer() as conn:
+            conn.execute("DELETE FROM upload_session_media WHERE user_id = ?", (user_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO upload_sessions(user_id, data, updated_at) VALUES(?,?,?)",
+                (user_id, json.dumps(session), int(time.time())),
+            )
+
+    def _update(self, user_id: int, fields: Dict[str, Any]) -> None:
+        session = dict(new_upload_session(user_id), **fields)
+        del session["media_list"]
+        with get_db_pool().writer() as conn:
+            conn.execute(
+                "INSERT INTO upload_sessions(user_id, data, updated_at) VALUES(?,?,?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = json_patch(data, ?), updated_at = excluded.updated_at",
+                (user_id, json.dumps(session), int(time.time()), json.dumps(fields)),
+            )
+
+    def _add_media(self, user_id: int, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with get_db_pool().writer() as conn:
+            c = conn.execute(
+                "INSERT INTO upload_session_media(user_id, data) "
+                "SELECT ?, ? WHERE EXISTS (SELECT 1 FROM upload_sessions WHERE user_id = ?)",
+                (user_id, json.dumps(item), user_id),
+            )
+            if c.rowcount == 0:
+                return None
+            return self._load(conn, user_id)
+
+    def _discard(self, user_id: int) -> None:
+        with get_db_pool().writer() as conn:
+            conn.execute("DELETE FROM upload_session_media WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM upload_sessions WHERE user_id = ?", (user_id,))
+
+    def _get_state(self, key: str) -> Optional[int]:
+        with get_db_pool().reader() as conn:
+            row = conn.execute("SELECT state FROM conversation_states WHERE conv_key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key: str, state: Optional[int]) -> None:
+        with get_db_pool().writer() as conn:
+            if state is None:
+                conn.execute("DELETE FROM conversation_states WHERE conv_key = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO conversation_states(conv_key, state, updated_at) VALUES(?,?,?)",
+                    (key, state, int(time.time())),
+                )
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await run_db(self._get, user_id)
+
+    async def start(self, user_id: int) -> None:
+        await run_db_write(self._start, user_id)
+
+    async def update(self, user_id: int, **fields: Any) -> None:
+        await run_db_write(self._update, user_id, fields)
+
+    async def add_media(self, user_id: int, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await run_db_write(self._add_media, user_id, item)
+
+    async def discard(self, user_id: int) -> None:
+        await run_db_write(self._discard, user_id)
+
+    async def get_state(self, key: str) -> Optional[int]:
+        return await run_db(self._get_state, key)
+
+    async def set_state(self, key: str, state: Optional[int]) -> None:
+        await run_db_write(self._set_state, key, state)
+
+def create_session_store():
+    if SESSION_STORE == "sqlite":
+        return SQLiteSessionStore()
+    if SESSION_STORE != "memory":
+        raise RuntimeError(f"SESSION_STORE must be memory or sqlite (got {SESSION_STORE!r})")
+    if WEB_WORKERS > 1:
+        raise RuntimeError("WEB_WORKERS > 1 needs SESSION_STORE=sqlite; in-memory sessions are per process")
+    return MemorySessionStore()
+
+session_store = create_session_store()
 
 # ------------------------------
 # UI helpers
@@ -367,30 +1196,18 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_view_content(update: Update, context: ContextTypes.DEFAULT_TYPE, content_id: int):
     user = update.effective_user
     user_id = user.id
-    content = get_content(content_id)
+    content = await load_content(content_id)
     if not content:
         await update.effective_chat.send_message("Content not found.")
         return
-    requires_token = bool(content.get("requires_token"))
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("SELECT is_vip FROM users WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    is_vip = bool(row[0]) if row else False
-    conn.close()
-    if not requires_token or is_vip:
+    requires_token = bool(content.requires_token)
+    status = await load_user_status(user_id)
+    if not requires_token or status.is_vip:
         await send_content_media(update, context, content)
         return
 
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
     now = int(time.time())
-    c.execute(
-        "SELECT token,expires_at,is_used FROM tokens WHERE user_id = ? AND content_id = ? ORDER BY issued_at DESC LIMIT 1",
-        (user_id, content_id),
-    )
-    row = c.fetchone()
-    conn.close()
+    row = await run_db(get_latest_token, user_id, content_id)
     has_valid = False
     token_for_user = None
     if row:
@@ -399,7 +1216,7 @@ async def handle_view_content(update: Update, context: ContextTypes.DEFAULT_TYPE
             has_valid = True
             token_for_user = token_val
     if has_valid:
-        mark_token_used(token_for_user)
+        await run_db_write(mark_token_used, token_for_user)
         await send_content_media(update, context, content)
         return
     kb = kb_get_token_button_with_emoji(content_id)
@@ -410,52 +1227,170 @@ async def handle_view_content(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def handle_token_start(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str):
     user = update.effective_user
     user_id = user.id
-    t = get_valid_token(token)
+    t = await run_db(get_valid_token, token)
     if not t:
         await update.effective_chat.send_message("❌ Token invalid or expired.")
         return
     if t["user_id"] != user_id:
         await update.effective_chat.send_message("❌ Token doesn't belong to you.")
         return
-    mark_token_used(token)
-    content = get_content(t["content_id"])
+    await run_db_write(mark_token_used, token)
+    content = await load_content(t["content_id"])
     if not content:
         await update.effective_chat.send_message("Content not found.")
         return
     await send_content_media(update, context, content)
 
-async def send_content_media(update: Update, context: ContextTypes.DEFAULT_TYPE, content: Dict[str, Any]):
-    chat = update.effective_chat
-    desc = content.get("description", "")
-    requires_token = bool(content.get("requires_token"))
+MEDIA_GROUP_MAX = 10  # sendMediaGroup accepts 2-10 items
+COPY_MESSAGES_MAX = 100  # copyMessages accepts 1-100 message ids
+
+# one Bot API call of a delivery: bot method name and its arguments, minus chat_id
+DeliveryStep = Tuple[str, Dict[str, Any]]
+Delivery = Tuple[Tuple[DeliveryStep, ...], Tuple[DeliveryStep, ...]]
+
+async def send_steps(bot, chat_id: Any, steps: Tuple[DeliveryStep, ...]) -> List[Any]:
+    results = []
+    for method, kwargs in steps:
+        results.append(await getattr(bot, method)(chat_id=chat_id, **kwargs))
+    return results
+
+async def send_pipelined(bot, chat_id: Any, *sequences: Tuple[DeliveryStep, ...]) -> None:
+    # the first step (the captioned album chunk) goes out alone so nothing lands above it;
+    # the rest overlap, each sequence in its own order. Raises the first failure
+    sequences = tuple(seq for seq in sequences if seq)
+    if not sequences:
+        return
+    await send_steps(bot, chat_id, sequences[0][:1])
+    sequences = (sequences[0][1:],) + sequences[1:]
+    results = await asyncio.gather(*[send_steps(bot, chat_id, seq) for seq in sequences if seq], return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+def media_group_steps(items: List[Any], protect: bool) -> Tuple[DeliveryStep, ...]:
+    # one step per MEDIA_GROUP_MAX chunk; a single-item chunk is sent on its own
+    steps: List[DeliveryStep] = []
+    for i in range(0, len(items), MEDIA_GROUP_MAX):
+        group = items[i:i + MEDIA_GROUP_MAX]
+        if len(group) > 1:
+            steps.append(("send_media_group", {"media": tuple(group), "protect_content": protect}))
+            continue
+        item = group[0]
+        if isinstance(item, InputMediaPhoto):
+            method, field = "send_photo", "photo"
+        elif isinstance(item, InputMediaVideo):
+            method, field = "send_video", "video"
+        else:
+            method, field = "send_document", "document"
+        steps.append((method, {field: item.media, "caption": item.caption, "protect_content": protect}))
+    return tuple(steps)
+
+def build_delivery(content: Content, protect: bool) -> Delivery:
+    desc = content.description or ""
+    requires_token = bool(content.requires_token)
     label = "🔒 Token: Required" if requires_token else "🟢 Free"
     caption_intro = f"{desc}\n\n{label}"
-    media_items = content.get("media_items", [])
+    media_items = content.media_items
     medias = []
-    for i, m in enumerate(media_items):
-        caption_text = caption_intro if i == 0 else None
-        if m["media_type"] == "photo":
-            medias.append(InputMediaPhoto(media=m["file_id"], caption=caption_text))
-        elif m["media_type"] == "video":
-            medias.append(InputMediaVideo(media=m["file_id"], caption=caption_text))
-    try:
-        if medias:
-            if len(medias) == 1:
-                if isinstance(medias[0], InputMediaPhoto):
-                    await chat.send_photo(photo=medias[0].media, caption=medias[0].caption, protect_content=content_protection)
-                else:
-                    await chat.send_video(video=medias[0].media, caption=medias[0].caption, protect_content=content_protection)
-            else:
-                await chat.send_media_group(media=medias[:10], protect_content=content_protection)
+    for m in media_items:
+        # caption only on the first item, i.e. on the first chunk of the album
+        caption_text = None if medias else caption_intro
+        if m.media_type == "photo":
+            medias.append(InputMediaPhoto(media=m.file_id, caption=caption_text))
+        elif m.media_type == "video":
+            medias.append(InputMediaVideo(media=m.file_id, caption=caption_text))
+    documents = [InputMediaDocument(media=m.file_id) for m in media_items if m.media_type not in ("photo", "video")]
+    if medias:
+        album = media_group_steps(medias, protect)
+    else:
+        thumb = content.thumb_file_id
+        if thumb:
+            album = (("send_photo", {"photo": thumb, "caption": caption_intro, "protect_content": protect}),)
         else:
-            thumb = content.get("thumb_file_id")
-            if thumb:
-                await chat.send_photo(photo=thumb, caption=caption_intro, protect_content=content_protection)
+            album = (("send_message", {"text": caption_intro}),)
+    # documents cannot share an album with photos/videos; they go out as their own groups
+    return album, media_group_steps(documents, protect)
+
+def get_delivery(content: Content, protect: bool) -> Delivery:
+    # saves the caption and InputMedia building only; serializing the request is still paid per send
+    key = (content.content_id, protect)
+    cached = delivery_cache.get(key)
+    # records are replaced, never mutated, on edit: a different object means a stale entry
+    if cached is not None and cached[0] is content:
+        return cached[1]
+    delivery = build_delivery(content, protect)
+    delivery_cache.put(key, (content, delivery), delivery_cache.generation)
+    return delivery
+
+def skip_delivered(delivery: Delivery, count: int) -> Delivery:
+    # what is left of a delivery after its first count messages were copied
+    rest: List[Tuple[DeliveryStep, ...]] = []
+    for steps in delivery:
+        remaining: List[DeliveryStep] = []
+        for method, kwargs in steps:
+            size = len(kwargs["media"]) if method == "send_media_group" else 1
+            if count >= size:
+                count -= size
+                continue
+            if count:
+                # an album cut mid-way: send only the items that did not get through
+                remaining.extend(media_group_steps(list(kwargs["media"][count:]), kwargs["protect_content"]))
+                count = 0
             else:
-                await chat.send_message(caption_intro)
-        for m in media_items:
-            if m["media_type"] not in ("photo", "video"):
-                await chat.send_document(document=m["file_id"], protect_content=content_protection)
+                remaining.append((method, kwargs))
+        rest.append(tuple(remaining))
+    return rest[0], rest[1]
+
+async def copy_from_storage(context: ContextTypes.DEFAULT_TYPE, chat_id: int, content: Content) -> int:
+    # returns how many messages were copied before a chunk failed or came back short
+    ids = list(content.storage_message_ids)
+    for i in range(0, len(ids), COPY_MESSAGES_MAX):
+        chunk = ids[i:i + COPY_MESSAGES_MAX]
+        try:
+            copied = await context.bot.copy_messages(
+                chat_id=chat_id, from_chat_id=STORAGE_CHANNEL_ID, message_ids=chunk,
+                protect_content=content_protection,
+            )
+        except Exception:
+            logger.exception("copyMessages failed for content %s after %d messages; sending the rest from file ids",
+                             content.content_id, i)
+            return i
+        if len(copied) < len(chunk):
+            # copyMessages silently skips posts it cannot copy (deleted from the channel, say) and does
+            # not say which, so this whole chunk is resent; the stored copy is rebuilt for later views
+            logger.warning("copyMessages copied %d of %d messages of content %s; sending them from file ids",
+                           len(copied), len(chunk), content.content_id)
+            context.application.create_task(mirror_content_to_storage(context.bot, content.content_id))
+            return i
+    return len(ids)
+
+async def mirror_content_to_storage(bot, content_id: int) -> None:
+    # copy the content into STORAGE_CHANNEL_ID and record its message ids
+    try:
+        content = await load_content(content_id)
+        if content is None:
+            return
+        message_ids: List[int] = []
+        # one send at a time so the ids come out in delivery order (copyMessages wants them increasing);
+        # unprotected, because protected messages cannot be copied
+        for steps in build_delivery(content, protect=False):
+            for sent in await send_steps(bot, STORAGE_CHANNEL_ID, steps):
+                message_ids.extend(m.message_id for m in (sent if isinstance(sent, (list, tuple)) else (sent,)))
+        await run_db_write(set_storage_message_ids, content_id, message_ids)
+    except Exception:
+        logger.exception("Failed to mirror content %s to the storage channel", content_id)
+
+async def send_content_media(update: Update, context: ContextTypes.DEFAULT_TYPE, content: Content):
+    chat = update.effective_chat
+    try:
+        delivery = get_delivery(content, content_protection)
+        if STORAGE_CHANNEL_ID and content.storage_message_ids:
+            copied = await copy_from_storage(context, chat.id, content)
+            if copied == len(content.storage_message_ids):
+                return
+            # only what the failed chunks should have carried; earlier chunks already arrived
+            delivery = skip_delivered(delivery, copied)
+        await send_pipelined(context.bot, chat.id, *delivery)
     except Exception as e:
         logger.exception("Failed to send media: %s", e)
         try:
@@ -465,18 +1400,13 @@ async def send_content_media(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
 async def cmd_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("SELECT is_vip FROM users WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    is_vip = bool(row[0]) if row else False
-    conn.close()
-    if is_vip:
-        sessions[user_id] = {"uploader_id": user_id, "media_list": []}
+    status = await load_user_status(user_id)
+    if status.is_vip:
+        await session_store.start(user_id)
         await update.message.reply_text("🌟 VIP detected — you can upload now. Send the thumbnail image (photo).")
         return STATE_THUMBNAIL
-    if user_is_authed(user_id):
-        sessions[user_id] = {"uploader_id": user_id, "media_list": []}
+    if status.is_authed():
+        await session_store.start(user_id)
         await update.message.reply_text("🔓 Password validated. Please send the thumbnail image now (photo).")
         return STATE_THUMBNAIL
     else:
@@ -486,9 +1416,9 @@ async def cmd_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def password_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = (update.message.text or "").strip()
-    if text == PASSWORD:
-        set_user_auth(user_id)
-        sessions[user_id] = {"uploader_id": user_id, "media_list": []}
+    if text == await run_db(get_upload_password):
+        await set_user_auth(user_id)
+        await session_store.start(user_id)
         await update.message.reply_text("✅ Password accepted for 24 hours. Now send the thumbnail image (photo).")
         return STATE_THUMBNAIL
     else:
@@ -500,8 +1430,7 @@ async def thumbnail_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.photo:
         photo = update.message.photo[-1]
         file_id = photo.file_id
-        session = sessions.setdefault(user_id, {"uploader_id": user_id, "media_list": []})
-        session["thumb_file_id"] = file_id
+        await session_store.update(user_id, thumb_file_id=file_id)
         await update.message.reply_text("🖼️ Thumbnail saved. Now send the description text message.")
         return STATE_DESCRIPTION
     else:
@@ -514,8 +1443,7 @@ async def description_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not text:
         await update.message.reply_text("Please send a non-empty description.")
         return STATE_DESCRIPTION
-    session = sessions.get(user_id)
-    session["description"] = text
+    await session_store.update(user_id, description=text)
     await update.message.reply_text("Choose how you want to add content (or Cancel):", reply_markup=kb_upload_options_with_emoji())
     return STATE_OPTION
 
@@ -525,50 +1453,48 @@ async def option_pressed(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     data = query.data
     if data == "opt_cancel":
-        sessions.pop(user_id, None)
+        await session_store.discard(user_id)
         await query.edit_message_text("Upload canceled and session reset.")
         return ConversationHandler.END
     if data == "opt_url_text":
         await query.edit_message_text("Send the URL or text that will be saved as the content (no media).")
-        session = sessions.setdefault(user_id, {"uploader_id": user_id, "media_list": []})
-        session["is_text_only"] = True
+        await session_store.update(user_id, is_text_only=True)
         return STATE_MEDIA_UPLOAD
     if data == "opt_forward":
         await query.edit_message_text("Now forward the media messages from any chat to me. When done, send /done .")
-        session = sessions.setdefault(user_id, {"uploader_id": user_id, "media_list": []})
-        session["expect_forward"] = True
+        await session_store.update(user_id, expect_forward=True)
         return STATE_MEDIA_UPLOAD
     if data == "opt_upload_phone":
         await query.edit_message_text("Now send photos/videos/documents from your phone. When finished, send /done .")
-        session = sessions.setdefault(user_id, {"uploader_id": user_id, "media_list": []})
-        session["expect_forward"] = False
+        await session_store.update(user_id, expect_forward=False)
         return STATE_MEDIA_UPLOAD
     await query.edit_message_text("Unknown option.")
     return ConversationHandler.END
 
 async def media_receiver(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    session = sessions.get(user_id)
+    session = await session_store.get(user_id)
     if not session:
         await update.message.reply_text("No active upload session. Send /upload to start.")
         return ConversationHandler.END
     if session.get("is_text_only"):
         await update.message.reply_text("You selected URL/Text. Send the text/URL now (or /cancel).")
         return STATE_MEDIA_UPLOAD
-    added = False
+    is_forwarded = 1 if getattr(update.message, "forward_from", None) or getattr(update.message, "forward_from_chat", None) else 0
+    items = []
     if update.message.photo:
         photo = update.message.photo[-1]
-        session["media_list"].append({"file_id": photo.file_id, "file_unique_id": photo.file_unique_id, "media_type": "photo", "is_forwarded": 1 if getattr(update.message, "forward_from", None) or getattr(update.message, "forward_from_chat", None) else 0})
-        added = True
+        items.append({"file_id": photo.file_id, "file_unique_id": photo.file_unique_id, "media_type": "photo", "is_forwarded": is_forwarded})
     if update.message.video:
         vid = update.message.video
-        session["media_list"].append({"file_id": vid.file_id, "file_unique_id": vid.file_unique_id, "media_type": "video", "is_forwarded": 1 if getattr(update.message, "forward_from", None) or getattr(update.message, "forward_from_chat", None) else 0})
-        added = True
+        items.append({"file_id": vid.file_id, "file_unique_id": vid.file_unique_id, "media_type": "video", "is_forwarded": is_forwarded})
     if update.message.document:
         doc = update.message.document
-        session["media_list"].append({"file_id": doc.file_id, "file_unique_id": doc.file_unique_id, "media_type": "document", "is_forwarded": 1 if getattr(update.message, "forward_from", None) or getattr(update.message, "forward_from_chat", None) else 0})
-        added = True
-    if added:
+        items.append({"file_id": doc.file_id, "file_unique_id": doc.file_unique_id, "media_type": "document", "is_forwarded": is_forwarded})
+    for item in items:
+        # appended one row at a time, so album parts never overwrite each other
+        session = await session_store.add_media(user_id, item) or session
+    if items:
         counts = count_media_for_session(session)
         await update.message.reply_text(f"Saved media. Current counts — 🖼 Photos: {counts['photos']}, 🎬 Videos: {counts['videos']}, 📁 Other: {counts['other']}. When finished send /done or /cancel.")
     else:
@@ -577,7 +1503,7 @@ async def media_receiver(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def url_text_receive(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    session = sessions.get(user_id)
+    session = await session_store.get(user_id)
     if not session or not session.get("is_text_only"):
         await update.message.reply_text("No URL/Text upload session active. Use /upload to start.")
         return ConversationHandler.END
@@ -585,12 +1511,12 @@ async def url_text_receive(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not text:
         await update.message.reply_text("Please send a non-empty URL or text.")
         return STATE_MEDIA_UPLOAD
-    session["url_text"] = text
+    await session_store.update(user_id, url_text=text)
     return await ask_token_requirement(update, context)
 
 async def done_receiving_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    session = sessions.get(user_id)
+    session = await session_store.get(user_id)
     if not session:
         await update.message.reply_text("No active session. Send /upload to start.")
         return ConversationHandler.END
@@ -609,26 +1535,27 @@ async def token_choice_callback(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = query.from_user.id
     data = query.data
     if data == "opt_cancel":
-        sessions.pop(user_id, None)
+        await session_store.discard(user_id)
         await query.edit_message_text("Upload canceled and session reset.")
         return ConversationHandler.END
     requires_token = 1 if data == "tok_yes" else 0
-    session = sessions.get(user_id)
+    session = await session_store.get(user_id)
+    if not session:
+        await query.edit_message_text("No active upload session. Send /upload to start.")
+        return ConversationHandler.END
     thumbnail = session.get("thumb_file_id")
     description = session.get("description", "")
     is_text_only = 1 if session.get("is_text_only") else 0
-    content_id = save_content_to_db(user_id, thumbnail, description, is_text_only, requires_token)
-    for m in session.get("media_list", []):
-        add_media_item(content_id, m["file_id"], m.get("file_unique_id", ""), m["media_type"], m.get("is_forwarded", 0))
+    description_to_save = description
     if is_text_only:
         url_text = session.get("url_text", "")
         if url_text:
             description_to_save = f"{description}\n\n[URL/TEXT]\n{url_text}"
-            conn = sqlite3.connect(DB_PATH, timeout=30)
-            c = conn.cursor()
-            c.execute("UPDATE content SET description = ? WHERE content_id = ?", (description_to_save, content_id))
-            conn.commit()
-            conn.close()
+    content_id = await run_db_write(
+        commit_content, user_id, thumbnail, description_to_save, is_text_only, requires_token, session.get("media_list", [])
+    )
+    if STORAGE_CHANNEL_ID:
+        context.application.create_task(mirror_content_to_storage(context.bot, content_id))
     counts = count_media_for_session(session)
     summary = f"🖼 Photos: {counts['photos']} | 🎬 Videos: {counts['videos']}"
     bot_username = (context.bot.username or "").lstrip("@")
@@ -637,23 +1564,19 @@ async def token_choice_callback(update: Update, context: ContextTypes.DEFAULT_TY
     caption = f"{session.get('description','')}\n\n{summary}\n\n{'🔒 Token: Required' if requires_token else '🟢 Free'}"
     try:
         sent = await context.bot.send_photo(chat_id=MAIN_CHANNEL_ID, photo=thumbnail, caption=caption, reply_markup=kb)
-        conn = sqlite3.connect(DB_PATH, timeout=30)
-        c = conn.cursor()
-        c.execute("UPDATE content SET main_channel_message_id = ? WHERE content_id = ?", (sent.message_id, content_id))
-        conn.commit()
-        conn.close()
+        await run_db_write(set_main_channel_message_id, content_id, sent.message_id)
     except Exception as e:
         logger.exception("Failed to post to main channel: %s", e)
         await query.edit_message_text(f"Saved content (id {content_id}) but failed to post to MAIN CHANNEL. Error: {e}")
-        sessions.pop(user_id, None)
+        await session_store.discard(user_id)
         return ConversationHandler.END
     await query.edit_message_text(f"✅ Content posted to main channel as content_id {content_id}.\nWatch link: {watch_link}\nUpload finished.")
-    sessions.pop(user_id, None)
+    await session_store.discard(user_id)
     return ConversationHandler.END
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    sessions.pop(user_id, None)
+    await session_store.discard(user_id)
     await update.message.reply_text("Upload cancelled and session reset.")
     return ConversationHandler.END
 
@@ -670,7 +1593,7 @@ async def callback_get_token_exeio(update: Update, context: ContextTypes.DEFAULT
         await query.edit_message_text("Invalid content id.")
         return
     user_id = query.from_user.id
-    token = create_token_for_user(user_id, content_id)
+    token = await run_db_write(create_token_for_user, user_id, content_id)
     bot_username = (context.bot.username or "").lstrip("@")
     long_watch_link = f"https://t.me/{bot_username}?start=token_{token}"
     short_link = await exeio_shorten_long_url(long_watch_link)
@@ -702,7 +1625,7 @@ async def cmd_addvip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("Invalid user id")
         return
-    set_user_vip(uid, 1)
+    await run_db_write(set_user_vip, uid, 1)
     await update.message.reply_text(f"User {uid} marked as VIP.")
 
 async def cmd_delvip(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -718,7 +1641,7 @@ async def cmd_delvip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("Invalid user id")
         return
-    set_user_vip(uid, 0)
+    await run_db_write(set_user_vip, uid, 0)
     await update.message.reply_text(f"User {uid} removed from VIPs.")
 
 async def cmd_changepass(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -734,7 +1657,7 @@ async def cmd_changepass(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Password cannot be empty.")
         return
     try:
-        set_password_in_db(newpass)
+        await run_db_write(set_password_in_db, newpass)
         await update.message.reply_text("🔒 Upload password changed successfully and saved.")
     except Exception as e:
         logger.exception("Failed to change password.")
@@ -742,19 +1665,14 @@ async def cmd_changepass(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_myinfo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    c = conn.cursor()
-    c.execute("SELECT last_auth,is_vip FROM users WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    if not row:
+    status = await load_user_status(user_id)
+    if not status.known:
         await update.message.reply_text("❌ You are not authenticated and not a VIP. Use /upload to start and provide password.")
         return
-    last_auth, is_vip = row
-    if is_vip:
+    if status.is_vip:
         await update.message.reply_text("🌟 You are a VIP user. You can upload and view token-protected content without tokens.")
         return
-    remaining = max(0, int(PASSWORD_VALID_SECONDS - (time.time() - last_auth)))
+    remaining = status.auth_remaining()
     hrs = remaining // 3600
     mins = (remaining % 3600) // 60
     secs = remaining % 60
@@ -763,8 +1681,51 @@ async def cmd_myinfo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ------------------------------
 # Application setup
 # ------------------------------
+class SharedConversation:
+    # ConversationHandler keeps states in process memory; this keeps them in session_store.
+    # Runs as a TypeHandler in group -1 and stops the update once one of its handlers matched
+
+    def __init__(self, entry_points: List[BaseHandler], states: Dict[int, List[BaseHandler]],
+                 fallbacks: List[BaseHandler], allow_reentry: bool = False):
+        self.entry_points = entry_points
+        self.states = states
+        self.fallbacks = fallbacks
+        self.allow_reentry = allow_reentry
+
+    @staticmethod
+    def _key(update: Update) -> Optional[str]:
+        # same (chat, user) key as ConversationHandler's defaults
+        if update.effective_chat is None or update.effective_user is None:
+            return None
+        return f"{update.effective_chat.id}:{update.effective_user.id}"
+
+    def _candidates(self, state: Optional[int]) -> Iterator[BaseHandler]:
+        if state is None or self.allow_reentry:
+            yield from self.entry_points
+        if state is not None:
+            yield from self.states.get(state, ())
+            yield from self.fallbacks
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        key = self._key(update)
+        if key is None:
+            return
+        state = await session_store.get_state(key)
+        for handler in self._candidates(state):
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                break
+        else:
+            return
+        new_state = await handler.handle_update(update, context.application, check, context)
+        if new_state == ConversationHandler.END:
+            await session_store.set_state(key, None)
+        elif new_state is not None:
+            await session_store.set_state(key, new_state)
+        raise ApplicationHandlerStop
+
 def build_conversation_handler():
-    conv = ConversationHandler(
+    spec = dict(
         entry_points=[CommandHandler("upload", cmd_upload)],
         states={
             STATE_PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, password_text)],
@@ -782,12 +1743,17 @@ def build_conversation_handler():
         fallbacks=[CommandHandler("cancel", cancel_command)],
         allow_reentry=True,
     )
-    return conv
+    if isinstance(session_store, SQLiteSessionStore):
+        return TypeHandler(Update, SharedConversation(**spec))
+    return ConversationHandler(**spec)
 
 def setup_application(app: Application):
     conv = build_conversation_handler()
     app.add_handler(CommandHandler("start", start_handler))
-    app.add_handler(conv)
+    if isinstance(conv, ConversationHandler):
+        app.add_handler(conv)
+    else:
+        app.add_handler(conv, group=-1)
     app.add_handler(CallbackQueryHandler(option_pressed, pattern="^opt_"))
     app.add_handler(CallbackQueryHandler(token_choice_callback, pattern="^tok_"))
     app.add_handler(CallbackQueryHandler(callback_get_token_exeio, pattern="^gettok_"))
@@ -804,6 +1770,531 @@ async def ptb_error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         logger.exception("Failed to notify user about error")
 
+# ------------------------------
+# Update dispatch
+# ------------------------------
+def update_ordering_key(update: Update) -> Hashable:
+    # same key: strictly in order. Per user, else per chat, else per update
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    if update.effective_chat is not None:
+        return ("chat", update.effective_chat.id)
+    return ("update", update.update_id)
+
+class UpdateIdWindow:
+    # ring of recent update_ids indexed by update_id % size (update_id only grows)
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._slots = array("q", [-1]) * self.size
+        self.accepted = 0
+        self.duplicates = 0
+
+    def add(self, update_id: int) -> bool:
+        # False if already seen
+        slot = update_id % self.size
+        if self._slots[slot] == update_id:
+            self.duplicates += 1
+            return False
+        self._slots[slot] = update_id
+        self.accepted += 1
+        return True
+
+    def discard(self, update_id: int) -> None:
+        # forget an id we did not process, so Telegram's retry is not dropped
+        slot = update_id % self.size
+        if self._slots[slot] == update_id:
+            self._slots[slot] = -1
+            self.accepted -= 1
+
+    def metrics(self) -> Dict[str, int]:
+        return {"window": self.size, "accepted": self.accepted, "duplicates": self.duplicates}
+
+# priority classes, most urgent first
+PRIORITY_INTERACTIVE = 0  # callback queries and /start deep-link views
+PRIORITY_NORMAL = 1       # commands and text
+PRIORITY_BULK = 2         # media messages (uploads / forwarded media)
+PRIORITY_NAMES = ("interactive", "normal", "bulk")
+
+def update_priority(update: Update) -> int:
+    if update.callback_query is not None:
+        return PRIORITY_INTERACTIVE
+    message = update.message
+    if message is not None:
+        if message.photo or message.video or message.document:
+            return PRIORITY_BULK
+        if (message.text or "").startswith("/start "):
+            return PRIORITY_INTERACTIVE
+    return PRIORITY_NORMAL
+
+class SharedUpdateOrder:
+    # WEB_WORKERS > 1: Telegram delivers over several connections, so one user's
+    # updates land on different workers at once. Every accepted update is
+    # registered here under its ordering key, and a worker only runs it once it is
+    # the oldest registered update of that key; per-user order then holds across
+    # processes. Rows of a dead worker stop blocking once their lease lapses;
+    # live workers renew only the rows they still hold.
+    POLL_MIN = 0.01
+    POLL_MAX = 0.2
+
+    def __init__(self, lease_seconds: float):
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._renew_task: Optional[asyncio.Task] = None
+        self._held: set = set()  # registered by us, not yet released
+        self._unreleased: set = set()  # release failed; retried by the renew loop
+        self.duplicates = 0
+        self.waits = 0
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return ":".join(map(str, key))
+
+    def _register(self, key: str, update_id: int) -> bool:
+        with get_db_pool().writer() as conn:
+            c = conn.execute(
+                "INSERT OR IGNORE INTO update_order(update_id, order_key, owner, expires_at) VALUES(?,?,?,?)",
+                (update_id, key, self.owner, time.time() + self.lease_seconds),
+            )
+            return c.rowcount == 1
+
+    def _head(self, key: str) -> Optional[Tuple[int, str]]:
+        with get_db_pool().reader() as conn:
+            return conn.execute(
+                "SELECT update_id, owner FROM update_order WHERE order_key = ? AND expires_at >= ? "
+                "ORDER BY update_id LIMIT 1",
+                (key, time.time()),
+            ).fetchone()
+
+    def _release(self, update_id: int) -> None:
+        with get_db_pool().writer() as conn:
+            conn.execute("DELETE FROM update_order WHERE update_id = ? AND owner = ?", (update_id, self.owner))
+
+    def _renew(self, held: List[int], unreleased: List[int]) -> None:
+        with get_db_pool().writer() as conn:
+            conn.executemany("DELETE FROM update_order WHERE update_id = ? AND owner = ?",
+                             [(update_id, self.owner) for update_id in unreleased])
+            expires_at = time.time() + self.lease_seconds
+            conn.executemany("UPDATE update_order SET expires_at = ? WHERE update_id = ? AND owner = ?",
+                             [(expires_at, update_id, self.owner) for update_id in held])
+            # and forget rows whose worker is gone
+            conn.execute("DELETE FROM update_order WHERE expires_at < ?", (time.time() - self.lease_seconds,))
+
+    def register(self, key: Hashable, update_id: int) -> "asyncio.Future[bool]":
+        # held from here on, so release() also covers an insert whose result we never saw
+        self._held.add(update_id)
+        return asyncio.ensure_future(run_db_write(self._register, self._key(key), update_id))
+
+    async def wait_turn(self, key: Hashable, update_id: int, registration: "asyncio.Future[bool]") -> bool:
+        # False: another worker registered this update_id first (a re-delivery), skip it
+        if not await registration:
+            self.duplicates += 1
+            return False
+        key = self._key(key)
+        delay = self.POLL_MIN
+        while True:
+            head = await run_db(self._head, key)
+            # an older update of ours is queued behind this one locally; waiting would deadlock
+            if head is None or head[0] == update_id or head[1] == self.owner:
+                return True
+            self.waits += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.POLL_MAX)
+
+    async def release(self, update_id: int) -> None:
+        self._held.discard(update_id)
+        try:
+            await run_db_write(self._release, update_id)
+        except Exception:
+            self._unreleased.add(update_id)
+            logger.exception("Failed to release update %s; retrying with the next lease renewal", update_id)
+
+    def start(self) -> None:
+        self._renew_task = asyncio.create_task(self._renew_loop())
+
+    async def stop(self) -> None:
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            self._renew_task = None
+
+    async def _renew_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            unreleased = list(self._unreleased)
+            try:
+                await run_db_write(self._renew, list(self._held), unreleased)
+                self._unreleased.difference_update(unreleased)
+            except Exception:
+                logger.exception("Failed to renew update order leases")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"owner": self.owner, "duplicates": self.duplicates, "waits": self.waits}
+
+class UpdateDispatcher:
+    # per-key FIFOs between the webhook and process_update, one worker per key at a time.
+    # Each priority class may fill the queue up to its own limit, so bulk media is shed first
+
+    def __init__(self, workers: int, limits: Tuple[int, int, int]):
+        self.workers = max(1, workers)
+        self.limits = tuple(max(1, n) for n in limits)
+        self._ready: List[Deque[Hashable]] = [deque() for _ in PRIORITY_NAMES]
+        self._ready_count: Optional[asyncio.Semaphore] = None
+        self._accepting = False
+        self._pending: Dict[Hashable, Deque[Tuple[int, Update]]] = {}
+        self._size = 0
+        self._idle: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._busy_replies: set = set()
+        self._application: Optional[Application] = None
+        self._order: Optional[SharedUpdateOrder] = None
+        self._registrations: Dict[int, "asyncio.Future[bool]"] = {}
+        self.accepted = [0] * len(PRIORITY_NAMES)
+        self.shed = [0] * len(PRIORITY_NAMES)
+        self.processed = 0
+        self.failed = 0
+
+    @property
+    def depth(self) -> int:
+        return self._size
+
+    @property
+    def running(self) -> bool:
+        return self._accepting
+
+    def start(self, application: Application, order: Optional[SharedUpdateOrder] = None) -> None:
+        self._application = application
+        self._order = order
+        if order is not None:
+            order.start()
+        self._ready_count = asyncio.Semaphore(0)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._accepting = True
+
+    def submit(self, update: Update) -> bool:
+        # False when not running or over its class limit
+        priority = update_priority(update)
+        if not self._accepting or self._size >= self.limits[priority]:
+            self.shed[priority] += 1
+            return False
+        key = update_ordering_key(update)
+        if self._order is not None:
+            # registered on receipt, so a later update of this user on another worker waits for it
+            self._registrations[update.update_id] = self._order.register(key, update.update_id)
+        backlog = self._pending.get(key)
+        if backlog is None:
+            self._pending[key] = deque(((priority, update),))
+            self._schedule(key, priority)
+        else:
+            # the key is queued or being processed; its worker picks this up next
+            backlog.append((priority, update))
+        self._size += 1
+        self._idle.clear()
+        self.accepted[priority] += 1
+        return True
+
+    def reply_busy(self, update: Update) -> None:
+        if self._application is None or len(self._busy_replies) >= UPDATE_BUSY_REPLIES_MAX:
+            return
+        task = asyncio.create_task(self._reply_busy(update))
+        self._busy_replies.add(task)
+        task.add_done_callback(self._busy_replies.discard)
+
+    async def _reply_busy(self, update: Update) -> None:
+        bot = self._application.bot
+        try:
+            if update.callback_query is not None:
+                await bot.answer_callback_query(update.callback_query.id, text="⏳ Bot is busy, please retry in a moment.")
+            elif update.effective_chat is not None:
+                await bot.send_message(update.effective_chat.id, "⏳ Bot is busy right now, please send that again in a moment.")
+        except Exception:
+            logger.exception("Failed to send busy reply")
+
+    async def stop(self, timeout: float) -> None:
+        if not self._accepting:
+            return
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Update queue not drained within %.0fs; dropping %d updates", timeout, self._size)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._busy_replies, return_exceptions=True)
+        self._tasks = []
+        for ready in self._ready:
+            ready.clear()
+        self._pending.clear()
+        self._registrations.clear()
+        self._size = 0
+        if self._order is not None:
+            await self._order.stop()
+
+    def _schedule(self, key: Hashable, priority: int) -> None:
+        self._ready[priority].append(key)
+        self._ready_count.release()
+
+    async def _worker(self) -> None:
+        while True:
+            await self._ready_count.acquire()
+            key = next(ready.popleft() for ready in self._ready if ready)
+            backlog = self._pending[key]
+            _, update = backlog.popleft()
+            try:
+                if self._order is None:
+                    await self._application.process_update(update)
+                    self.processed += 1
+                else:
+                    registration = self._registrations.pop(update.update_id)
+                    try:
+                        if await self._order.wait_turn(key, update.update_id, registration):
+                            await self._application.process_update(update)
+                            self.processed += 1
+                    finally:
+                        # also when wait_turn failed: a row left behind would block this user on every worker
+                        await self._order.release(update.update_id)
+            except Exception:
+                self.failed += 1
+                logger.exception("Error while processing update")
+            finally:
+                self._size -= 1
+                if backlog:
+                    # back of its class, so a busy user cannot starve the others
+                    self._schedule(key, backlog[0][0])
+                else:
+                    del self._pending[key]
+                if self._size == 0:
+                    self._idle.set()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.depth,
+            "active_keys": len(self._pending),
+            "ready": {name: len(self._ready[i]) for i, name in enumerate(PRIORITY_NAMES)},
+            "limits": dict(zip(PRIORITY_NAMES, self.limits)),
+            "accepted": dict(zip(PRIORITY_NAMES, self.accepted)),
+            "shed": dict(zip(PRIORITY_NAMES, self.shed)),
+            "busy_replies_in_flight": len(self._busy_replies),
+            "processed": self.processed,
+            "failed": self.failed,
+            "order": self._order.metrics() if self._order is not None else None,
+        }
+
+def decode_json(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+dispatcher = UpdateDispatcher(UPDATE_WORKERS, (UPDATE_QUEUE_SIZE, UPDATE_NORMAL_LIMIT, UPDATE_BULK_LIMIT))
+seen_updates = UpdateIdWindow(UPDATE_DEDUP_WINDOW)
+webhook_counters: Dict[str, int] = {"ignored_types": 0, "missing_secret": 0, "bad_secret": 0}
+
+class UpdatePoller:
+    # getUpdates transport; a batch shed in "retry" mode keeps the offset so Telegram resends it
+
+    def __init__(self, limit: int = 100, timeout: int = 30):
+        self.limit = max(1, min(limit, 100))
+        self.timeout = timeout
+        self._offset: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._bot = None
+        self.batches = 0
+        self.received = 0
+        self.deferred = 0
+        self.errors = 0
+
+    async def start(self, application: Application) -> None:
+        self._bot = application.bot
+        # getUpdates is refused while a webhook is set; keep whatever is pending
+        await self._bot.delete_webhook(drop_pending_updates=False)
+        self._task = asyncio.create_task(self._loop())
+        logger.info("Polling for updates (limit %d, timeout %ds)", self.limit, self.timeout)
+
+    async def _loop(self) -> None:
+        allowed = list(HANDLED_UPDATE_TYPES)
+        while True:
+            try:
+                updates = await self._bot.get_updates(
+                    offset=self._offset, limit=self.limit, timeout=self.timeout, allowed_updates=allowed
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors += 1
+                logger.exception("getUpdates failed; retrying in %.0fs", POLL_RETRY_SECONDS)
+                await asyncio.sleep(POLL_RETRY_SECONDS)
+                continue
+            self.batches += 1
+            self.received += len(updates)
+            if not self._feed(updates):
+                # queue full: give the workers a moment, then fetch again from the deferred update
+                await asyncio.sleep(0.2)
+
+    def _feed(self, updates: List[Update]) -> bool:
+        # False when it stopped early because the queue is full
+        for update in updates:
+            if seen_updates.add(update.update_id) and not dispatcher.submit(update):
+                if UPDATE_SHED_MODE == "reply" and dispatcher.running:
+                    dispatcher.reply_busy(update)
+                else:
+                    seen_updates.discard(update.update_id)
+                    self.deferred += 1
+                    return False
+            self._offset = update.update_id + 1
+        return True
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._offset is not None:
+            # confirm what was handed to the dispatcher so a restart does not fetch it again
+            try:
+                await self._bot.get_updates(offset=self._offset, limit=1, timeout=0)
+            except Exception:
+                logger.exception("Failed to confirm polled updates")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "offset": self._offset,
+            "batches": self.batches,
+            "received": self.received,
+            "avg_batch": round(self.received / self.batches, 1) if self.batches else 0,
+            "deferred": self.deferred,
+            "errors": self.errors,
+        }
+
+poller = UpdatePoller(POLL_LIMIT, POLL_TIMEOUT)
+
+# ------------------------------
+# Outbound rate limiting
+# ------------------------------
+class TokenBucket:
+    # reserve() always takes a token, going into debt, and returns the wait;
+    # single event loop, so callers are served in arrival order without a lock
+    __slots__ = ("rate", "burst", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # set from Telegram's retry_after
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+class BotRateLimiter(BaseRateLimiter):
+    # paces Bot API calls against the overall and per-chat buckets (groups get the per-minute one);
+    # RetryAfter blocks the chat (or everything) and retries up to max_retries times
+
+    # long polls hold the connection open; they are not messages
+    UNLIMITED_ENDPOINTS = ("getUpdates",)
+
+    def __init__(self, overall_rate: float = 30, chat_rate: float = 1, chat_burst: int = 3,
+                 group_per_minute: float = 20, max_retries: int = 3, max_chats: int = 10000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._overall = TokenBucket(overall_rate, overall_rate)
+        self._chats: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        self.calls = 0
+        self.delayed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.retry_after = 0
+        self.gave_up = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+        try:
+            is_group = int(chat_id) < 0
+        except (TypeError, ValueError):
+            is_group = True  # "@channelusername"
+        if is_group:
+            bucket = TokenBucket(self.group_rate, self.group_rate * 60)
+        else:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        self._chats[chat_id] = bucket
+        if len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+        return bucket
+
+    async def _acquire(self, chat_id: Any) -> None:
+        start = time.monotonic()
+        if chat_id is not None:
+            wait = self._chat_bucket(chat_id).reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        wait = self._overall.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        waited = time.monotonic() - start
+        self.calls += 1
+        if waited > 0.001:
+            self.delayed += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in self.UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+        chat_id = data.get("chat_id")
+        attempt = 0
+        while True:
+            await self._acquire(chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                self.retry_after += 1
+                if attempt >= self.max_retries:
+                    self.gave_up += 1
+                    raise
+                attempt += 1
+                delay = float(exc.retry_after)
+                bucket = self._overall if chat_id is None else self._chat_bucket(chat_id)
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+                logger.warning("Flood control on %s (chat %s): retrying in %.0fs", endpoint, chat_id, delay)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "delayed": self.delayed,
+            "wait_avg_ms": round(self.wait_total / self.delayed * 1000, 1) if self.delayed else 0,
+            "wait_max_ms": round(self.wait_max * 1000, 1),
+            "retry_after": self.retry_after,
+            "gave_up": self.gave_up,
+            "tracked_chats": len(self._chats),
+        }
+
+rate_limiter = BotRateLimiter(
+    RATE_LIMIT_OVERALL / WEB_WORKERS, RATE_LIMIT_CHAT, RATE_LIMIT_CHAT_BURST,
+    RATE_LIMIT_GROUP_PER_MIN / WEB_WORKERS, RATE_LIMIT_MAX_RETRIES
+) if RATE_LIMIT else None
+
 # ------------------------------
 # Quart app (replaces Flask for full async support)
 # ------------------------------
@@ -838,26 +2329,66 @@ telegram_app: Optional[Application] = None
 async def home():
     return "✅ Bot is alive (webhook)."
 
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    return {
+        "updates": dispatcher.metrics(),
+        "dedup": seen_updates.metrics(),
+        "webhook": dict(webhook_counters, json_decoder="orjson" if orjson is not None else "json"),
+        "write_behind": write_behind.metrics(),
+        "content_cache": content_cache.stats(),
+        "delivery_cache": delivery_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "worker": {"pid": os.getpid(), "web_workers": WEB_WORKERS},
+        "transport": TRANSPORT,
+        "poller": poller.metrics() if TRANSPORT == "polling" else None,
+        "rate_limiter": rate_limiter.metrics() if rate_limiter is not None else None,
+    }
+
 @app.route(TELEGRAM_WEBHOOK_PATH, methods=["POST"])
 async def telegram_webhook_entry():
     global telegram_app
+    if TRANSPORT != "webhook":
+        # updates come from getUpdates; nothing may be injected through this path
+        return "not found", 404
+    # checked before the body is read, so junk traffic costs a header lookup
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+    if secret is None:
+        webhook_counters["missing_secret"] += 1
+        return "forbidden", 403
+    if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+        webhook_counters["bad_secret"] += 1
+        return "forbidden", 403
     if telegram_app is None:
         logger.warning("Telegram app not initialized yet")
         return "service unavailable", 503
     try:
-        data = await request.get_json(force=True)
+        data = decode_json(await request.get_data())
     except Exception:
         logger.exception("Failed to parse json body")
         return "bad request", 400
+    update_id = data.get("update_id") if isinstance(data, dict) else None
+    if not isinstance(update_id, int):
+        return "bad request", 400
+    if not any(key in data for key in HANDLED_UPDATE_TYPES):
+        # edited messages, channel posts, ... have no handler; skip building the object graph
+        webhook_counters["ignored_types"] += 1
+        return "ok", 200
+    if not seen_updates.add(update_id):
+        # re-delivery of an update we already queued; ack it so Telegram stops retrying
+        return "ok", 200
     try:
         update = Update.de_json(data, telegram_app.bot)
     except Exception:
         logger.exception("Failed to build Update")
+        seen_updates.discard(update_id)
         return "bad request", 400
-    try:
-        await telegram_app.process_update(update)
-    except Exception:
-        logger.exception("Error while processing update")
+    if not dispatcher.submit(update):
+        if UPDATE_SHED_MODE == "reply" and dispatcher.running:
+            dispatcher.reply_busy(update)
+            return "ok", 200
+        seen_updates.discard(update_id)
+        return "busy", 503
     return "ok", 200
 
 # ------------------------------
@@ -867,12 +2398,14 @@ async def create_and_start_application() -> Application:
     global telegram_app
     
     # Use Application.builder() without updater - this avoids the Updater issue
-    application = (
+    builder = (
         Application.builder()
         .token(UPLOAD_BOT_TOKEN)
         .updater(None)  # CRITICAL: Disable updater to avoid Python 3.13 issue
-        .build()
     )
+    if rate_limiter is not None:
+        builder = builder.rate_limiter(rate_limiter)
+    application = builder.build()
     
     application.add_error_handler(ptb_error_handler)
     setup_application(application)
@@ -899,41 +2432,124 @@ async def set_webhook_if_needed(application: Application):
     except Exception:
         logger.exception("Failed to delete previous webhook (continuing)")
     try:
-        await application.bot.set_webhook(url=webhook)
+        await application.bot.set_webhook(
+            url=webhook, allowed_updates=list(HANDLED_UPDATE_TYPES), secret_token=WEBHOOK_SECRET
+        )
         logger.info("Webhook set successfully to %s", webhook)
     except Exception:
         logger.exception("Failed to set webhook")
 
-async def _run():
-    # Init DB & password
-    init_db()
-    load_password_from_db()
+async def _run(listen_fd: Optional[int] = None, primary: bool = True):
+    # listen_fd: socket shared by the web workers (already migrated);
+    # only the primary worker sets the webhook and runs the background DB jobs
+    if listen_fd is None:
+        # Init DB & password
+        init_db()
+        load_password_from_db()
 
     # Create and start telegram Application
     application = await create_and_start_application()
 
     # Set webhook
-    await set_webhook_if_needed(application)
+    if primary and TRANSPORT == "webhook":
+        await set_webhook_if_needed(application)
+
+    checkpoint_task = asyncio.create_task(wal_checkpoint_loop()) if primary and DB_CHECKPOINT_SECONDS > 0 else None
+    migration_task = asyncio.create_task(run_online_migrations()) if primary else None
+    write_behind.start()
+    dispatcher.start(application, SharedUpdateOrder(UPDATE_ORDER_LEASE_SECONDS) if listen_fd is not None else None)
+    if TRANSPORT == "polling":
+        await poller.start(application)
 
     # Serve Quart via Hypercorn
-    config = Config()
-    config.bind = [f"0.0.0.0:{PORT}"]
+    config = HypercornConfig()
+    config.bind = [f"fd://{listen_fd}"] if listen_fd is not None else [f"0.0.0.0:{PORT}"]
     config.workers = 1
     config.use_reloader = False
 
-    logger.info("Starting ASGI server (Hypercorn) on port %d", PORT)
+    # SIGTERM (deploys, run_workers) and Ctrl-C stop the server gracefully so updates drain
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    logger.info("Starting ASGI server (Hypercorn) on %s", config.bind[0])
     try:
-        await serve(app, config)
+        await serve(app, config, shutdown_trigger=stop_event.wait)
     finally:
         logger.info("Hypercorn stopped — shutting down Telegram app")
+        if checkpoint_task:
+            checkpoint_task.cancel()
+        if migration_task:
+            migration_task.cancel()
+        await poller.stop()
+        await dispatcher.stop(UPDATE_DRAIN_TIMEOUT)
         try:
-            await application.shutdown()
             await application.stop()
+            await application.shutdown()
         except Exception:
             logger.exception("Error when shutting down Telegram app")
+        try:
+            await write_behind.stop()
+        except Exception:
+            logger.exception("Failed to flush write-behind queue")
+        shutdown_db_executor()
+        close_db_pool()
+
+def _worker_main(index: int, listen_fd: int) -> None:
+    logger.info("Web worker %d started (pid %d)", index, os.getpid())
+    asyncio.run(_run(listen_fd=listen_fd, primary=index == 0))
+
+def run_workers(count: int) -> None:
+    # parent migrates, forks count workers on one socket and forwards SIGTERM/SIGINT;
+    # if a worker dies the rest are stopped so the platform restarts the service
+    init_db()
+    load_password_from_db()
+    # never carry open sqlite handles across fork(); every worker opens its own pool
+    close_db_pool()
+
+    sock = socket.create_server(("0.0.0.0", PORT), backlog=2048)
+    ctx = multiprocessing.get_context("fork")
+    workers = [
+        ctx.Process(target=_worker_main, args=(i, sock.fileno()), name=f"web-{i}")
+        for i in range(count)
+    ]
+    for p in workers:
+        p.start()
+    sock.close()
+    logger.info("Started %d web workers on port %d", count, PORT)
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for p in workers:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    ready = multiprocessing.connection.wait([p.sentinel for p in workers])
+    failed = not stopping
+    if failed:
+        dead = next(p for p in workers if p.sentinel in ready)
+        dead.join()
+        logger.error("Web worker %s exited with code %s; stopping the others", dead.name, dead.exitcode)
+        _stop(None, None)
+    for p in workers:
+        p.join()
+    if failed:
+        raise SystemExit(1)
 
 def main():
-    asyncio.run(_run())
+    if WEB_WORKERS > 1:
+        run_workers(WEB_WORKERS)
+    else:
+        asyncio.run(_run())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
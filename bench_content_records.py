@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Allocations per content view in ai.py: dict rows (two queries) vs Content/MediaItem records (one JOIN).
+
+- "dicts" runs the old get_content body: the content row and its media rows as
+  two queries, each row turned into a dict.
+- "records" runs ai._fetch_content: one JOIN into slotted, frozen records.
+- Both run on the same pooled reader connection, so only the row handling differs.
+- Under tracemalloc, reports per view the peak bytes allocated while loading and
+  the bytes the loaded content keeps alive, plus microseconds per view
+  (timed without tracemalloc), for contents of 1, 10 and 50 media items.
+
+Records keep less alive per loaded content (what content_cache holds). A cache
+miss costs more on large contents, though: the JOIN repeats the content columns
+on every media row, and frozen dataclasses are slower to build than dicts.
+
+Usage: python bench_content_records.py   (exit code 1 if records retain more than dicts)
+"""
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import ai  # noqa: E402
+
+MEDIA_COUNTS = (1, 10, 50)
+HELD = 200  # loaded contents kept alive at once to measure what they retain
+TIMED = 5000
+
+CONTENT_KEYS = ["content_id", "uploader_id", "thumb_file_id", "description", "is_text_only", "requires_token",
+                "created_at", "main_channel_message_id"]
+
+def load_dicts(content_id: int):
+    # get_content before the JOIN and the records
+    with ai.get_db_pool().reader() as conn:
+        c = conn.cursor()
+        c.execute("SELECT content_id, uploader_id, thumb_file_id, description, is_text_only, requires_token, "
+                  "created_at, main_channel_message_id FROM content WHERE content_id = ?", (content_id,))
+        row = c.fetchone()
+        if not row:
+            return None
+        content = dict(zip(CONTENT_KEYS, row))
+        c.execute("SELECT media_id, file_id, file_unique_id, media_type, is_forwarded FROM media_items "
+                  "WHERE content_id = ? ORDER BY media_id ASC", (content_id,))
+        content["media_items"] = [
+            {"media_id": r[0], "file_id": r[1], "file_unique_id": r[2], "media_type": r[3], "is_forwarded": r[4]}
+            for r in c.fetchall()
+        ]
+    return content
+
+def load_records(content_id: int):
+    content = ai._fetch_content(content_id)
+    # _fetch_content also caches the record; drop it so only the returned object stays alive
+    ai.content_cache.invalidate(content_id)
+    return content
+
+def measure(load, content_id: int) -> tuple:
+    load(content_id)  # warm statement cache and pages
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    held = [load(content_id) for _ in range(HELD)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    retained = (current - base) / HELD
+    del held
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    load(content_id)
+    peak_one = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for _ in range(TIMED):
+        load(content_id)
+    us = (time.perf_counter() - started) / TIMED * 1e6
+    return peak_one, retained, us
+
+def main() -> int:
+    ai.init_db()
+    failed = False
+    for count in MEDIA_COUNTS:
+        media = [{"file_id": f"AgACAgQAAxkBAAI{n:08d}", "file_unique_id": f"AQAD{n:08d}", "media_type": "photo"}
+                 for n in range(count)]
+        content_id = ai.commit_content(1000, "thumb", "description " * 5, 0, 1, media)
+        d_peak, d_kept, d_us = measure(load_dicts, content_id)
+        r_peak, r_kept, r_us = measure(load_records, content_id)
+        print(f"{count:>3} media | dicts   peak {d_peak:7.0f} B  retained {d_kept:7.0f} B  {d_us:6.1f} us")
+        print(f"{'':>3}       | records peak {r_peak:7.0f} B  retained {r_kept:7.0f} B  {r_us:6.1f} us")
+        failed |= r_kept > d_kept
+    ai.close_db_pool()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
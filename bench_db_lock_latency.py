@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Webhook latency while the SQLite writer is held (ai.py run_db check).
+
+- Holds get_db_pool().writer() on a thread for HOLD_SECONDS.
+- Times GET / and webhook POSTs through Quart's test client before and during the hold.
+- Every posted update runs a handler that needs the writer, so those handlers
+  pile up on the DB write executor; the event loop itself must stay responsive.
+- Times the view path's DB reads (a content cache miss plus the token lookup)
+  through run_db as well; they must not queue behind the blocked writes.
+
+Usage: python bench_db_lock_latency.py   (exit code 1 if latency does not stay flat)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import statistics
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["RATE_LIMIT"] = "0"
+
+import ai  # noqa: E402
+
+HOLD_SECONDS = 3.0
+REQUESTS = 200
+# during the hold, p95 may grow by at most this much over the baseline
+MAX_P95_GROWTH_MS = 25.0
+# and no single view read may take longer than this
+MAX_READ_MS = 250.0
+
+class WritingApp:
+    # stand-in for the PTB Application: every update needs the (held) writer
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def process_update(self, update):
+        await ai.run_db_write(ai.set_user_vip, update.effective_user.id, 0)
+
+def update_body(update_id: int) -> bytes:
+    uid = 1000 + update_id % 50
+    return json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": "hi",
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": "bench"},
+        },
+    }).encode()
+
+async def view_reads(uid: int) -> None:
+    # what a deep-link view reads on a cache miss
+    await ai.run_db(ai._fetch_content, 1)
+    await ai.run_db(ai.get_latest_token, uid, 1)
+
+async def timed(client, next_id) -> tuple:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": ai.WEBHOOK_SECRET, "Content-Type": "application/json"}
+    home, hook, reads = [], [], []
+    for n in range(REQUESTS):
+        t = time.perf_counter()
+        resp = await client.get("/")
+        home.append((time.perf_counter() - t) * 1000)
+        assert resp.status_code == 200, resp.status_code
+        t = time.perf_counter()
+        resp = await client.post(ai.TELEGRAM_WEBHOOK_PATH, data=update_body(next_id()), headers=headers)
+        hook.append((time.perf_counter() - t) * 1000)
+        # 503 would mean the update was shed, which must not happen here either
+        assert resp.status_code == 200, resp.status_code
+        t = time.perf_counter()
+        await view_reads(1000 + n % 50)
+        reads.append((time.perf_counter() - t) * 1000)
+    return home, hook, reads
+
+def p95(samples) -> float:
+    return statistics.quantiles(samples, n=20)[-1]
+
+def report(label, home, hook, reads):
+    print(f"{label:<10} GET /  p50 {statistics.median(home):6.2f} ms  p95 {p95(home):6.2f} ms | "
+          f"webhook p50 {statistics.median(hook):6.2f} ms  p95 {p95(hook):6.2f} ms | "
+          f"view reads p50 {statistics.median(reads):6.2f} ms  p95 {p95(reads):6.2f} ms  max {max(reads):7.2f} ms")
+
+async def main() -> int:
+    ai.init_db()
+    application = ai.Application.builder().token(ai.UPLOAD_BOT_TOKEN).updater(None).build()
+    ai.telegram_app = application
+    ai.dispatcher.start(WritingApp(application.bot))
+    counter = iter(range(1, 10 ** 9))
+    client = ai.app.test_client()
+
+    base_home, base_hook, base_reads = await timed(client, lambda: next(counter))
+    report("baseline", base_home, base_hook, base_reads)
+
+    held = threading.Event()
+
+    def hold_writer():
+        with ai.get_db_pool().writer():
+            held.set()
+            time.sleep(HOLD_SECONDS)
+
+    holder = threading.Thread(target=hold_writer, daemon=True)
+    holder.start()
+    held.wait()
+    lock_home, lock_hook, lock_reads = await timed(client, lambda: next(counter))
+    report("lock held", lock_home, lock_hook, lock_reads)
+    if holder.is_alive():
+        print(f"(writer still held after the run; {REQUESTS} request pairs fit in the {HOLD_SECONDS:.0f}s hold)")
+    holder.join()
+
+    await ai.dispatcher.stop(30)
+    ai.shutdown_db_executor()
+    ai.close_db_pool()
+
+    growth = max(p95(lock_home) - p95(base_home), p95(lock_hook) - p95(base_hook), p95(lock_reads) - p95(base_reads))
+    print(f"p95 growth under the held write lock: {growth:.2f} ms (limit {MAX_P95_GROWTH_MS:.0f} ms)")
+    # a single view read stuck behind the held writer is a failure even if p95 hides it
+    print(f"slowest view read under the held write lock: {max(lock_reads):.2f} ms (limit {MAX_READ_MS:.0f} ms)")
+    return 0 if growth <= MAX_P95_GROWTH_MS and max(lock_reads) <= MAX_READ_MS else 1
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
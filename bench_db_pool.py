@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Per-update DB overhead in ai.py: connect-per-call (the old helpers) vs DBPool.
+
+- A deep-link view reads its token and marks it used: one read, one write.
+- "connect" runs those two statements the way the old helpers did, opening and
+  closing a sqlite3 connection around each one. It applies the same connection
+  pragmas as the pool, so only connection reuse differs.
+- "pool" runs ai.get_valid_token / ai.mark_token_used on the pooled connections.
+- Reports microseconds per view for both, against the same database file.
+
+Usage: python bench_db_pool.py   (exit code 1 if the pool is not faster)
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import statistics
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import ai  # noqa: E402
+
+TOKENS = 2000
+VIEWS = 5000
+ROUNDS = 5
+
+def connect_read(token: str):
+    # get_valid_token before the pool
+    conn = sqlite3.connect(ai.DB_PATH, timeout=30)
+    ai.apply_connection_pragmas(conn)
+    c = conn.cursor()
+    c.execute("SELECT token,user_id,content_id,issued_at,expires_at FROM tokens WHERE token = ?", (token,))
+    row = c.fetchone()
+    conn.close()
+    return row
+
+def connect_write(token: str):
+    # mark_token_used before the pool
+    conn = sqlite3.connect(ai.DB_PATH, timeout=30)
+    ai.apply_connection_pragmas(conn)
+    c = conn.cursor()
+    c.execute("UPDATE tokens SET is_used = 1 WHERE token = ?", (token,))
+    conn.commit()
+    conn.close()
+
+def pool_read(token: str):
+    return ai.get_valid_token(token)
+
+def pool_write(token: str):
+    ai.mark_token_used(token)
+
+def per_view_us(read, write, tokens) -> float:
+    started = time.perf_counter()
+    for n in range(VIEWS):
+        token = tokens[n % len(tokens)]
+        read(token)
+        write(token)
+    return (time.perf_counter() - started) / VIEWS * 1e6
+
+def main() -> int:
+    ai.init_db()
+    tokens = [ai.create_token_for_user(1000 + n % 100, 1 + n % 50) for n in range(TOKENS)]
+    # interleaved rounds so both paths see the same page cache and disk state
+    connect, pool = [], []
+    for _ in range(ROUNDS):
+        connect.append(per_view_us(connect_read, connect_write, tokens))
+        pool.append(per_view_us(pool_read, pool_write, tokens))
+    ai.close_db_pool()
+    before, after = statistics.median(connect), statistics.median(pool)
+    print(f"connect-per-call: {before:8.1f} us per view (read + write)")
+    print(f"DBPool:           {after:8.1f} us per view (read + write)")
+    print(f"speedup: {before / after:.1f}x")
+    return 0 if after < before else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
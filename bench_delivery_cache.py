@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+CPU per delivery in ai.py: build_delivery vs a delivery_cache hit, next to what every send still pays.
+
+- "build" is ai.build_delivery: caption text and InputMedia objects for every item.
+- "cached" is ai.get_delivery on a warm delivery_cache (the record is unchanged).
+- "send" is ai.send_pipelined with the cached steps through a PTB bot whose fake
+  transport answers at once but serializes the request body like the real one
+  (RequestData.json_parameters), plus PTB parsing the canned replies. The cache
+  does not remove this part: PTB serializes the InputMedia objects on every send.
+- Contents of 1, 13 (10 photos + 3 documents) and 100 items; microseconds per delivery.
+
+Usage: python bench_delivery_cache.py   (exit code 1 if a cache hit is not cheaper than a build)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import ai  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+CONTENTS = ((1, 0), (10, 3), (90, 10))  # (photos, documents)
+BUILDS = 5000
+SENDS = 300
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+class FakeRequest(BaseRequest):
+    # serializes the body like HTTPXRequest does, then answers at once with canned messages
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        if endpoint == "getMe":
+            return 200, json.dumps({"ok": True, "result": BOT_USER}).encode()
+        params = request_data.json_parameters
+        message = {"message_id": 1, "date": 0, "chat": {"id": int(params["chat_id"]), "type": "private"}}
+        count = len(json.loads(params["media"])) if endpoint == "sendMediaGroup" else 0
+        result = [message] * count if count else message
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def per_call_us(fn, n: int) -> float:
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - started) / n * 1e6
+
+async def send_us(bot, delivery) -> float:
+    started = time.perf_counter()
+    for _ in range(SENDS):
+        await ai.send_pipelined(bot, 2000, *delivery)
+    return (time.perf_counter() - started) / SENDS * 1e6
+
+async def run() -> int:
+    ai.init_db()
+    application = ApplicationBuilder().token(ai.UPLOAD_BOT_TOKEN).request(FakeRequest()).updater(None).build()
+    await application.initialize()
+    failed = False
+    for photos, documents in CONTENTS:
+        media = [{"file_id": f"AgACAgQAAxkBAAI{n:08d}", "file_unique_id": f"AQAD{n:08d}", "media_type": "photo"}
+                 for n in range(photos)]
+        media += [{"file_id": f"BQACAgQAAxkBAAI{n:08d}", "file_unique_id": f"AgAD{n:08d}", "media_type": "document"}
+                  for n in range(documents)]
+        content = ai._fetch_content(ai.commit_content(1000, "thumb", "description " * 5, 0, 1, media))
+        build = per_call_us(lambda: ai.build_delivery(content, True), BUILDS)
+        ai.get_delivery(content, True)
+        cached = per_call_us(lambda: ai.get_delivery(content, True), BUILDS)
+        send = await send_us(application.bot, ai.get_delivery(content, True))
+        print(f"{photos + documents:>3} items  build {build:7.1f} us  cached {cached:5.1f} us  "
+              f"(saves {build - cached:6.1f} us)  | send, paid either way {send:8.1f} us")
+        failed |= cached >= build
+    await application.shutdown()
+    ai.close_db_pool()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run()))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Delivery time in ai.py's send_content_media: a 20-document pack, and photo albums of 10, 50 and 100 items.
+
+- "old" is send_content_media before document groups: the thumbnail with the
+  caption, then one awaited send_document per document.
+- "new" is ai.send_content_media: the caption message, then InputMediaDocument
+  groups of MEDIA_GROUP_MAX pipelined by send_pipelined.
+- Both go through a PTB bot with its real request serialization and a fake Bot
+  API transport that answers every call after API_LATENCY seconds.
+- Runs once without a rate limiter and once with ai's BotRateLimiter at its
+  default per-chat budget; reports Bot API calls and milliseconds per delivery.
+- Albums: "old" is the former single send_media_group(medias[:10]), which
+  dropped everything past the tenth item; "new" sends every item in chunks of
+  MEDIA_GROUP_MAX. Reports items delivered and end-to-end milliseconds.
+
+Usage: python bench_send_content.py   (exit code 1 if the pack is not faster or an album is cut short)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+DOCUMENTS = 20
+ALBUM_SIZES = (10, 50, 100)
+API_LATENCY = 0.05
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.pop("STORAGE_CHANNEL_ID", None)
+
+import ai  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+class FakeRequest(BaseRequest):
+    # answers every Bot API call after API_LATENCY; counts the calls and the messages sent
+    def __init__(self):
+        self.calls = 0
+        self.delivered = 0
+        self.message_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def message(self, chat_id) -> dict:
+        self.message_id += 1
+        return {"message_id": self.message_id, "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"}, "from": BOT_USER}
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        if endpoint == "getMe":
+            return 200, json.dumps({"ok": True, "result": BOT_USER}).encode()
+        self.calls += 1
+        params = request_data.parameters if request_data is not None else {}
+        await asyncio.sleep(API_LATENCY)
+        if endpoint == "sendMediaGroup":
+            media = params["media"]
+            if isinstance(media, str):
+                media = json.loads(media)
+            result = [self.message(params["chat_id"]) for _ in media]
+        else:
+            result = self.message(params["chat_id"])
+        self.delivered += len(result) if isinstance(result, list) else 1
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def new_limiter():
+    return ai.BotRateLimiter(ai.RATE_LIMIT_OVERALL, ai.RATE_LIMIT_CHAT, ai.RATE_LIMIT_CHAT_BURST,
+                             ai.RATE_LIMIT_GROUP_PER_MIN, ai.RATE_LIMIT_MAX_RETRIES)
+
+async def build_app(limiter):
+    request = FakeRequest()
+    builder = ApplicationBuilder().token(ai.UPLOAD_BOT_TOKEN).request(request).updater(None)
+    if limiter is not None:
+        builder = builder.rate_limiter(limiter)
+    application = builder.build()
+    await application.initialize()
+    return application, request
+
+async def send_old(bot, chat_id: int, content) -> None:
+    # send_content_media before document groups, for a content with no photos or videos
+    caption_intro = f"{content.description or ''}\n\n{'🔒 Token: Required' if content.requires_token else '🟢 Free'}"
+    await bot.send_photo(chat_id, photo=content.thumb_file_id, caption=caption_intro,
+                         protect_content=ai.content_protection)
+    for m in content.media_items:
+        if m.media_type not in ("photo", "video"):
+            await bot.send_document(chat_id, document=m.file_id, protect_content=ai.content_protection)
+
+async def send_album_old(bot, chat_id: int, content) -> None:
+    # send_content_media before chunking, for an album of photos
+    caption_intro = f"{content.description or ''}\n\n{'🔒 Token: Required' if content.requires_token else '🟢 Free'}"
+    medias = [ai.InputMediaPhoto(media=m.file_id, caption=None if n else caption_intro)
+              for n, m in enumerate(content.media_items)]
+    await bot.send_media_group(chat_id, media=medias[:10], protect_content=ai.content_protection)
+
+async def send_new(bot, chat_id: int, content) -> None:
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+    await ai.send_content_media(update, SimpleNamespace(bot=bot), content)
+
+async def timed(send, content, chat_id: int, limiter) -> tuple:
+    # a fresh bot (and limiter) per run so no budget carries over
+    application, request = await build_app(limiter)
+    started = time.perf_counter()
+    await send(application.bot, chat_id, content)
+    elapsed = (time.perf_counter() - started) * 1000
+    await application.shutdown()
+    return request.calls, request.delivered, elapsed
+
+async def run() -> int:
+    ai.init_db()
+    media = [{"file_id": f"BQACAgQAAxkBAAI{n:08d}", "file_unique_id": f"AgAD{n:08d}", "media_type": "document"}
+             for n in range(DOCUMENTS)]
+    content = ai._fetch_content(ai.commit_content(1000, "thumb", "document pack", 0, 0, media))
+    print(f"{DOCUMENTS}-document pack, {API_LATENCY * 1000:.0f} ms per Bot API call")
+    failed = False
+    for label, limiter in (("no rate limiter", None), ("BotRateLimiter", new_limiter)):
+        old_calls, _, old_ms = await timed(send_old, content, 2000, limiter and limiter())
+        new_calls, _, new_ms = await timed(send_new, content, 2001, limiter and limiter())
+        print(f"{label:<16} old {old_calls:>3} calls {old_ms:8.0f} ms | new {new_calls:>3} calls {new_ms:8.0f} ms"
+              f"  ({old_ms / new_ms:.1f}x)")
+        failed |= new_ms >= old_ms
+    print("photo albums (caption on the first chunk)")
+    for size in ALBUM_SIZES:
+        media = [{"file_id": f"AgACAgQAAxkBAAI{size:03d}{n:05d}", "file_unique_id": f"AQAD{size:03d}{n:05d}",
+                  "media_type": "photo"} for n in range(size)]
+        album = ai._fetch_content(ai.commit_content(1000, "thumb", "album", 0, 0, media))
+        for label, limiter in (("no rate limiter", None), ("BotRateLimiter", new_limiter)):
+            _, old_items, old_ms = await timed(send_album_old, album, 3000 + size, limiter and limiter())
+            new_calls, new_items, new_ms = await timed(send_new, album, 4000 + size, limiter and limiter())
+            print(f"{size:>4} items {label:<16} old {old_items:>4} delivered {old_ms:7.0f} ms | "
+                  f"new {new_items:>4} delivered in {new_calls:>2} calls {new_ms:7.0f} ms")
+            failed |= new_items != size
+    ai.close_db_pool()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run()))
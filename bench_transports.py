@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Updates/s in ai.py: getUpdates polling (UpdatePoller) vs the webhook route, through the same dispatcher.
+
+- One UpdateDispatcher and one Application with a handler that only counts, so
+  the transport and the dispatch path are what gets measured.
+- "polling" runs the real UpdatePoller loop against a local fake Bot API that
+  serves the updates from getUpdates in batches of POLL_LIMIT and honours the
+  offset; every batch goes through UpdatePoller._feed.
+- "webhook" posts the same updates as raw JSON to ai's Quart route with
+  WEBHOOK_CONNECTIONS concurrent senders (Telegram's default max_connections);
+  a 503 from a full queue is retried the way Telegram would.
+- UPDATE_SHED_MODE=retry, so a full queue slows a transport down instead of
+  dropping updates.
+- Reports updates/s from the first update in to the last one handled.
+
+Usage: python bench_transports.py   (exit code 1 if an update is lost or handled twice)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+
+USERS = 200
+UPDATES = 5000
+WEBHOOK_CONNECTIONS = 40
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["RATE_LIMIT"] = "0"
+# a full queue defers (polling) or answers 503 (webhook) instead of dropping with a busy reply
+os.environ["UPDATE_SHED_MODE"] = "retry"
+
+import ai  # noqa: E402
+from aiohttp import web  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder, ApplicationHandlerStop, TypeHandler  # noqa: E402
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+def update_dict(update_id: int) -> dict:
+    uid = 1000 + update_id % USERS
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": "hi",
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": "bench"},
+        },
+    }
+
+class FakeBotAPI:
+    # getMe and getUpdates on their own loop and thread; anything else just succeeds
+    def __init__(self):
+        self.pending: list = []
+        self.first_id = 0
+        self.calls = 0
+        self.base_url = ""
+
+    async def handle(self, req):
+        method = req.path.rsplit("/", 1)[-1]
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": BOT_USER})
+        if method != "getUpdates":
+            return web.json_response({"ok": True, "result": True})
+        data = await req.post()
+        self.calls += 1
+        offset = int(data.get("offset") or self.first_id)
+        start = max(0, offset - self.first_id)
+        batch = self.pending[start:start + int(data.get("limit", 100))]
+        if not batch:
+            # long poll with nothing pending
+            await asyncio.sleep(0.05)
+        return web.json_response({"ok": True, "result": batch})
+
+    def start(self) -> None:
+        api = web.Application()
+        api.router.add_route("POST", "/{tail:.*}", self.handle)
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        ports = []
+
+        async def serve():
+            runner = web.AppRunner(api)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            ports.append(runner.addresses[0][1])
+            ready.set()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(serve())
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        self.base_url = f"http://127.0.0.1:{ports[0]}/bot"
+
+handled = {}
+
+async def count(update, context):
+    handled[update.update_id] = handled.get(update.update_id, 0) + 1
+    raise ApplicationHandlerStop
+
+async def wait_handled(ids: range, timeout: float = 120) -> None:
+    deadline = time.monotonic() + timeout
+    while not all(i in handled for i in ids):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"only {sum(i in handled for i in ids)}/{len(ids)} updates handled")
+        await asyncio.sleep(0.001)
+
+async def run_polling(api: FakeBotAPI, application, ids: range) -> float:
+    api.first_id = ids.start
+    api.pending = [update_dict(i) for i in ids]
+    started = time.perf_counter()
+    await ai.poller.start(application)
+    await wait_handled(ids)
+    elapsed = time.perf_counter() - started
+    await ai.poller.stop()
+    return elapsed
+
+async def run_webhook(ids: range) -> tuple:
+    client = ai.app.test_client()
+    headers = {"X-Telegram-Bot-Api-Secret-Token": ai.WEBHOOK_SECRET, "Content-Type": "application/json"}
+    raws = [json.dumps(update_dict(i)).encode() for i in ids]
+    slots = asyncio.Semaphore(WEBHOOK_CONNECTIONS)
+    retries = [0]
+
+    async def post(raw):
+        async with slots:
+            while True:
+                resp = await client.post(ai.TELEGRAM_WEBHOOK_PATH, data=raw, headers=headers)
+                if resp.status_code == 200:
+                    return
+                assert resp.status_code == 503, resp.status_code
+                retries[0] += 1
+                await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[post(raw) for raw in raws])
+    await wait_handled(ids)
+    return time.perf_counter() - started, retries[0]
+
+async def run() -> int:
+    api = FakeBotAPI()
+    api.start()
+    ai.init_db()
+    application = ApplicationBuilder().token(ai.UPLOAD_BOT_TOKEN).base_url(api.base_url).updater(None).build()
+    application.add_handler(TypeHandler(Update, count), group=-1)
+    await application.initialize()
+    ai.telegram_app = application
+    ai.dispatcher.start(application)
+
+    polled = range(1, UPDATES + 1)
+    polling = await run_polling(api, application, polled)
+    posted = range(UPDATES + 1, 2 * UPDATES + 1)
+    webhook, retries = await run_webhook(posted)
+
+    await ai.dispatcher.stop(30)
+    await application.shutdown()
+    ai.shutdown_db_executor()
+    ai.close_db_pool()
+
+    print(f"{UPDATES} message updates from {USERS} users, {ai.UPDATE_WORKERS} dispatcher workers, counting handler")
+    print(f"polling  {UPDATES / polling:8.0f} updates/s  ({api.calls} getUpdates calls, "
+          f"avg batch {ai.poller.metrics()['avg_batch']}, {ai.poller.deferred} deferred)")
+    print(f"webhook  {UPDATES / webhook:8.0f} updates/s  ({WEBHOOK_CONNECTIONS} connections, {retries} 503 retries)")
+    bad = [i for i in (*polled, *posted) if handled.get(i) != 1]
+    if bad:
+        print(f"{len(bad)} updates lost or handled twice")
+    return 1 if bad else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run()))
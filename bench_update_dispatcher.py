@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Load test for ai.py's UpdateDispatcher.
+
+- Feeds USERS x UPDATES_PER_USER message updates through the dispatcher with 1..16 workers.
+- Each update runs an upload-style handler: read the user's session, await
+  (simulated Bot API I/O), write it back. Only strict per-user ordering keeps
+  every session's step list complete and in order.
+- Reports updates/s per worker count.
+
+Usage: python bench_update_dispatcher.py   (exit code 1 on a lost/reordered step or poor scaling)
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import ai  # noqa: E402
+from telegram import Update  # noqa: E402
+
+USERS = 40
+UPDATES_PER_USER = 10
+HANDLER_IO_SECONDS = 0.01
+WORKER_COUNTS = (1, 2, 4, 8, 16)
+# 8 workers must be at least this many times faster than 1
+MIN_SPEEDUP_AT_8 = 5.0
+
+class UploadFlowApp:
+    # stand-in for the PTB Application running a read-modify-write upload step
+    def __init__(self, store):
+        self.store = store
+        self.bot = None
+
+    async def process_update(self, update):
+        user_id = update.effective_user.id
+        session = await self.store.get(user_id) or ai.new_upload_session(user_id)
+        await asyncio.sleep(HANDLER_IO_SECONDS)
+        await self.store.update(user_id, steps=session.get("steps", []) + [int(update.message.text)])
+
+def make_update(update_id: int, user_id: int, step: int) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": str(step),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+        },
+    }, None)
+
+async def run(workers: int) -> tuple:
+    total = USERS * UPDATES_PER_USER
+    store = ai.MemorySessionStore()
+    dispatcher = ai.UpdateDispatcher(workers, (total, total, total))
+    app = UploadFlowApp(store)
+    dispatcher.start(app)
+    updates = [make_update(n, 1000 + n % USERS, n // USERS) for n in range(total)]
+    started = time.perf_counter()
+    for update in updates:
+        assert dispatcher.submit(update)
+    await dispatcher.stop(60)
+    elapsed = time.perf_counter() - started
+    expected = list(range(UPDATES_PER_USER))
+    broken = 0
+    for i in range(USERS):
+        session = await store.get(1000 + i)
+        if session is None or session.get("steps") != expected:
+            broken += 1
+    return total / elapsed, broken
+
+async def main() -> int:
+    rates = {}
+    failed = False
+    for workers in WORKER_COUNTS:
+        rate, broken = await run(workers)
+        rates[workers] = rate
+        failed |= broken > 0
+        print(f"{workers:>3} workers: {rate:8.0f} updates/s  sessions broken: {broken}/{USERS}")
+    speedup = rates[8] / rates[1]
+    print(f"speedup 8 vs 1 workers: {speedup:.1f}x (need {MIN_SPEEDUP_AT_8:.0f}x)")
+    return 1 if failed or speedup < MIN_SPEEDUP_AT_8 else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
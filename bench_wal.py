@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Concurrent reads during token writes in ai.py: rollback journal vs WAL.
+
+- READERS threads look tokens up with ai.get_valid_token while one thread keeps
+  issuing new ones with ai.create_token_for_user, for SECONDS.
+- Runs once with DB_JOURNAL_MODE=DELETE and once with WAL (the default profile),
+  each in a fresh process and database.
+- Reports reads/s, writes/s and read latency for both.
+
+Usage: python bench_wal.py   (exit code 1 if WAL does not read faster)
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import subprocess
+import statistics
+
+READERS = 4
+SECONDS = 3.0
+TOKENS = 2000
+MODES = ("DELETE", "WAL")
+
+def run_mode() -> dict:
+    # child: the journal mode comes from the environment, ai reads it at import
+    import ai
+    ai.init_db()
+    tokens = [ai.create_token_for_user(1000 + n % 100, 1 + n % 50) for n in range(TOKENS)]
+    stop = threading.Event()
+    latencies = [[] for _ in range(READERS)]
+    writes = [0]
+
+    def reader(samples):
+        n = 0
+        while not stop.is_set():
+            t = time.perf_counter()
+            ai.get_valid_token(tokens[n % len(tokens)])
+            samples.append((time.perf_counter() - t) * 1000)
+            n += 7
+
+    def writer():
+        while not stop.is_set():
+            ai.create_token_for_user(2000 + writes[0] % 100, 1 + writes[0] % 50)
+            writes[0] += 1
+
+    threads = [threading.Thread(target=reader, args=(s,)) for s in latencies] + [threading.Thread(target=writer)]
+    for th in threads:
+        th.start()
+    time.sleep(SECONDS)
+    stop.set()
+    for th in threads:
+        th.join()
+    with ai.get_db_pool().reader() as conn:
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    ai.close_db_pool()
+    samples = [x for s in latencies for x in s]
+    return {
+        "mode": mode,
+        "reads_per_s": len(samples) / SECONDS,
+        "writes_per_s": writes[0] / SECONDS,
+        "read_mean_ms": statistics.fmean(samples),
+        "read_p50_ms": statistics.median(samples),
+        "read_p99_ms": statistics.quantiles(samples, n=100)[-1],
+    }
+
+def main() -> int:
+    results = {}
+    for mode in MODES:
+        env = dict(os.environ, DB_JOURNAL_MODE=mode, DB_PATH=os.path.join(tempfile.mkdtemp(), "bench.db"))
+        env.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+        env.setdefault("WEBHOOK_SECRET", "bench-secret")
+        out = subprocess.run([sys.executable, __file__, "--child"], env=env, check=True,
+                             capture_output=True, text=True).stdout
+        r = results[mode] = json.loads(out.strip().splitlines()[-1])
+        print(f"{r['mode']:<7} reads {r['reads_per_s']:9.0f}/s  writes {r['writes_per_s']:7.0f}/s  "
+              f"read mean {r['read_mean_ms']:6.3f} ms  p50 {r['read_p50_ms']:6.3f} ms  p99 {r['read_p99_ms']:7.3f} ms")
+    ratio = results["WAL"]["reads_per_s"] / results["DELETE"]["reads_per_s"]
+    print(f"WAL vs rollback journal: {ratio:.1f}x reads/s with {READERS} readers and one writer")
+    return 0 if ratio > 1 else 1
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--child"]:
+        print(json.dumps(run_mode()))
+        sys.exit(0)
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+CPU per webhook update in ai.py: raw-bytes decode + ignored-type fast path vs get_json + Update.de_json.
+
+- "old" is what the endpoint did before: Quart's JSON provider on the body
+  (what request.get_json uses), then Update.de_json for every update.
+- "new" is ai.decode_json on the raw bytes, then Update.de_json only for the
+  types in HANDLED_UPDATE_TYPES; the rest are acked without building objects.
+- The body mix has IGNORED_SHARE of unhandled updates (edits, channel posts).
+- Runs with orjson (when installed) and with the stdlib json fallback.
+
+Usage: python bench_webhook_decode.py   (exit code 1 if the new path is not cheaper)
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import ai  # noqa: E402
+
+UPDATES = 20000
+IGNORED_SHARE = 0.3
+
+def message(update_id: int) -> dict:
+    uid = 1000 + update_id % 50
+    return {
+        "message_id": update_id, "date": 1700000000,
+        "chat": {"id": uid, "type": "private", "first_name": "bench", "username": "bench_user"},
+        "from": {"id": uid, "is_bot": False, "first_name": "bench", "username": "bench_user", "language_code": "en"},
+        "caption": "album part", "media_group_id": "13572468",
+        "photo": [{"file_id": f"AgACAgQAAxkBAAI{update_id:08d}{n}", "file_unique_id": f"AQAD{update_id:08d}{n}",
+                   "width": 90 * (n + 1), "height": 60 * (n + 1), "file_size": 1500 * (n + 1)} for n in range(3)],
+    }
+
+def bodies() -> list:
+    out = []
+    for n in range(UPDATES):
+        if n % 10 < IGNORED_SHARE * 10:
+            update = {"update_id": n, "edited_message": message(n)}
+        else:
+            update = {"update_id": n, "message": message(n)}
+        out.append(json.dumps(update).encode())
+    return out
+
+def old_path(raw: bytes, bot) -> None:
+    data = ai.app.json.loads(raw)
+    ai.Update.de_json(data, bot)
+
+def new_path(raw: bytes, bot) -> None:
+    data = ai.decode_json(raw)
+    if not any(key in data for key in ai.HANDLED_UPDATE_TYPES):
+        return
+    ai.Update.de_json(data, bot)
+
+def per_update_us(path, raws, bot) -> float:
+    started = time.perf_counter()
+    for raw in raws:
+        path(raw, bot)
+    return (time.perf_counter() - started) / len(raws) * 1e6
+
+def main() -> int:
+    bot = ai.Application.builder().token(ai.UPLOAD_BOT_TOKEN).updater(None).build().bot
+    raws = bodies()
+    orjson = ai.orjson
+    decoders = (("orjson", orjson), ("json", None)) if orjson is not None else (("json", None),)
+    if orjson is None:
+        print("orjson not installed; measuring the stdlib json fallback only")
+    old = per_update_us(old_path, raws, bot)
+    print(f"old  get_json + de_json for all:        {old:7.1f} us/update")
+    failed = False
+    for name, module in decoders:
+        ai.orjson = module
+        new = per_update_us(new_path, raws, bot)
+        print(f"new  {name:<6} decode + fast path:          {new:7.1f} us/update  ({old / new:.2f}x)")
+        failed |= new >= old
+    ai.orjson = orjson
+    print(f"({UPDATES} bodies, {IGNORED_SHARE:.0%} of them unhandled types)")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Side-by-side webhook entry points: main.py before/after the persistent loop, and ai.py.
+
+- "main.py old" is main.py's former route: Flask, Update.de_json, then
+  asyncio.run(app.process_update(update)) inside the request.
+- "main.py" is the current route: the update is handed to the Application on
+  main.py's persistent bot loop (PerUserUpdateProcessor) and acked at once.
+- "ai.py" is the Quart route feeding ai.py's UpdateDispatcher.
+- Every entry point gets the same USERS x UPDATES_PER_USER message updates from
+  CONCURRENCY concurrent senders, runs at most CONCURRENCY handlers at once, and
+  the same handler: one sendMessage through PTB's real HTTP client to a local
+  fake Bot API that answers after API_LATENCY seconds.
+- Reports updates/s (until every handler finished), failed updates and
+  webhook ack latency.
+
+The old route shares one PTB HTTP pool between short-lived asyncio.run loops;
+calls that land on a connection from a loop that is already gone never finish,
+so it is bounded by API_TIMEOUT and those updates are counted as failed.
+
+Usage: python bench_webhook_entrypoints.py   (exit code 1 if main.py did not beat its old route)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+USERS = 40
+UPDATES_PER_USER = 10
+CONCURRENCY = 16
+API_LATENCY = 0.02
+API_TIMEOUT = 2.0
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["RATE_LIMIT"] = "0"
+# same handler concurrency everywhere; the old route ran one handler per Flask thread
+os.environ["UPDATE_WORKERS"] = os.environ["UPDATE_CONCURRENCY"] = str(CONCURRENCY)
+
+import ai  # noqa: E402
+import main  # noqa: E402
+from aiohttp import web  # noqa: E402
+from flask import Flask, request  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder, ApplicationHandlerStop, TypeHandler  # noqa: E402
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+def start_fake_bot_api() -> str:
+    # getMe and sendMessage on their own loop and thread; returns the base_url for the bots
+    async def handle(req):
+        method = req.path.rsplit("/", 1)[-1]
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": BOT_USER})
+        data = await req.post()
+        await asyncio.sleep(API_LATENCY)
+        return web.json_response({"ok": True, "result": {
+            "message_id": 1, "date": int(time.time()), "text": data.get("text", ""),
+            "chat": {"id": int(data["chat_id"]), "type": "private"}, "from": BOT_USER,
+        }})
+
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    port = []
+
+    async def serve():
+        runner = web.AppRunner(_app(handle))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port.append(site._server.sockets[0].getsockname()[1])
+        ready.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{port[0]}/bot"
+
+def _app(handle):
+    application = web.Application()
+    application.router.add_route("POST", "/{tail:.*}", handle)
+    return application
+
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def add(self):
+        with self.lock:
+            self.value += 1
+
+handled = Counter()
+failed = Counter()
+base_url = ""
+
+async def reply(update, context):
+    try:
+        await context.bot.send_message(update.effective_chat.id, "ok")
+        handled.add()
+    except Exception:
+        failed.add()
+    raise ApplicationHandlerStop
+
+def build_app(processor=None):
+    # short timeouts for every path so a stuck Bot API call counts as failed instead of hanging the run
+    builder = (ApplicationBuilder().token(ai.UPLOAD_BOT_TOKEN).base_url(base_url).updater(None)
+               .connect_timeout(API_TIMEOUT).read_timeout(API_TIMEOUT).write_timeout(API_TIMEOUT)
+               .pool_timeout(API_TIMEOUT))
+    if processor is not None:
+        builder = builder.concurrent_updates(processor)
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, reply), group=-1)
+    return application
+
+def bodies(first_id: int) -> list:
+    out = []
+    for n in range(USERS * UPDATES_PER_USER):
+        uid = 1000 + n % USERS
+        out.append(json.dumps({
+            "update_id": first_id + n,
+            "message": {
+                "message_id": n, "date": int(time.time()), "text": "hi",
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": "bench"},
+            },
+        }).encode())
+    return out
+
+def finished() -> int:
+    return handled.value + failed.value
+
+def reset_counters() -> None:
+    handled.value = failed.value = 0
+
+def wait_finished(total: int, timeout: float = 120) -> None:
+    deadline = time.monotonic() + timeout
+    while finished() < total:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"only {finished()}/{total} updates finished")
+        time.sleep(0.001)
+
+def post_threaded(flask_app, path: str, raws: list) -> list:
+    local = threading.local()
+
+    def post(raw):
+        if not hasattr(local, "client"):
+            local.client = flask_app.test_client()
+        t = time.perf_counter()
+        resp = local.client.post(path, data=raw, content_type="application/json")
+        assert resp.status_code == 200, resp.status_code
+        return (time.perf_counter() - t) * 1000
+
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        return list(pool.map(post, raws))
+
+def run_main_old(raws: list) -> tuple:
+    old_app = build_app()
+    old_flask = Flask("main_old")
+
+    # as the old main(): initialized once inside a loop that is then closed. The old code also
+    # called start() there, but PTB's update fetcher ignores the cancellation asyncio.run sends
+    # on exit, so that hangs; process_update only needs initialize()
+    asyncio.run(old_app.initialize())
+
+    @old_flask.route("/webhook", methods=["POST"])
+    def webhook():
+        update = Update.de_json(request.get_json(), old_app.bot)
+        # the shared HTTP pool was set up on another (closed) loop, so a call can wait forever
+        # on a loop that is gone; bound it and count that as a failed update
+        try:
+            asyncio.run(asyncio.wait_for(old_app.process_update(update), API_TIMEOUT))
+        except asyncio.TimeoutError:
+            failed.add()
+        return "ok", 200
+
+    reset_counters()
+    started = time.perf_counter()
+    acks = post_threaded(old_flask, "/webhook", raws)
+    wait_finished(len(raws))
+    return time.perf_counter() - started, acks
+
+def run_main(raws: list) -> tuple:
+    main.app = build_app(main.PerUserUpdateProcessor(main.UPDATE_CONCURRENCY))
+    threading.Thread(target=main.run_bot_loop, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(main.app.initialize(), main.bot_loop).result()
+    asyncio.run_coroutine_threadsafe(main.app.start(), main.bot_loop).result()
+    reset_counters()
+    started = time.perf_counter()
+    acks = post_threaded(main.flask_app, f"/webhook/{main.BOT_TOKEN}", raws)
+    wait_finished(len(raws))
+    elapsed = time.perf_counter() - started
+    asyncio.run_coroutine_threadsafe(main.app.stop(), main.bot_loop).result()
+    asyncio.run_coroutine_threadsafe(main.app.shutdown(), main.bot_loop).result()
+    main.bot_loop.call_soon_threadsafe(main.bot_loop.stop)
+    return elapsed, acks
+
+async def run_ai(raws: list) -> tuple:
+    ai.init_db()
+    application = build_app()
+    await application.initialize()
+    ai.telegram_app = application
+    ai.dispatcher.start(application)
+    client = ai.app.test_client()
+    headers = {"X-Telegram-Bot-Api-Secret-Token": ai.WEBHOOK_SECRET, "Content-Type": "application/json"}
+    slots = asyncio.Semaphore(CONCURRENCY)
+
+    async def post(raw):
+        async with slots:
+            t = time.perf_counter()
+            resp = await client.post(ai.TELEGRAM_WEBHOOK_PATH, data=raw, headers=headers)
+            assert resp.status_code == 200, resp.status_code
+            return (time.perf_counter() - t) * 1000
+
+    reset_counters()
+    started = time.perf_counter()
+    acks = await asyncio.gather(*[post(raw) for raw in raws])
+    while finished() < len(raws):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    await ai.dispatcher.stop(30)
+    await application.shutdown()
+    ai.shutdown_db_executor()
+    ai.close_db_pool()
+    return elapsed, acks
+
+def report(label: str, elapsed: float, acks: list) -> tuple:
+    rate = handled.value / elapsed
+    print(f"{label:<12} {rate:7.0f} updates/s  failed {failed.value:>4}/{finished()}  "
+          f"ack p50 {statistics.median(acks):7.2f} ms  p95 {statistics.quantiles(acks, n=20)[-1]:7.2f} ms")
+    return rate, failed.value
+
+def main_() -> int:
+    global base_url
+    base_url = start_fake_bot_api()
+    total = USERS * UPDATES_PER_USER
+    print(f"{total} updates from {USERS} users, {CONCURRENCY} concurrent senders and handlers, "
+          f"{API_LATENCY * 1000:.0f} ms fake Bot API sendMessage per update")
+    old_rate, old_failed = report("main.py old", *run_main_old(bodies(1)))
+    new_rate, new_failed = report("main.py", *run_main(bodies(total + 1)))
+    report("ai.py", *asyncio.run(run_ai(bodies(2 * total + 1))))
+    return 0 if new_failed == 0 and (old_failed > new_failed or new_rate > old_rate) else 1
+
+if __name__ == "__main__":
+    sys.exit(main_())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Webhook secret-token check for ai.py, through Quart's test client.
+
+- Posts REQUESTS updates with no X-Telegram-Bot-Api-Secret-Token header,
+  REQUESTS with a wrong one, and REQUESTS with the right one.
+- Reports requests/s per case and the webhook counters from /metrics.
+- Rejected posts must get 403 and never reach the update queue.
+
+Usage: python bench_webhook_secret.py   (exit code 1 if a forged post gets through)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+
+os.environ.setdefault("UPLOAD_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["RATE_LIMIT"] = "0"
+
+import ai  # noqa: E402
+
+REQUESTS = 2000
+
+class NullApp:
+    # stand-in for the PTB Application; only counts what reaches it
+    def __init__(self, bot):
+        self.bot = bot
+        self.processed = 0
+
+    async def process_update(self, update):
+        self.processed += 1
+
+def update_body(update_id: int) -> bytes:
+    return json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": "hi",
+            "chat": {"id": 1000, "type": "private"},
+            "from": {"id": 1000, "is_bot": False, "first_name": "bench"},
+        },
+    }).encode()
+
+async def post_many(client, label, secret, first_id) -> int:
+    headers = {"Content-Type": "application/json"}
+    if secret is not None:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    statuses = {}
+    started = time.perf_counter()
+    for n in range(REQUESTS):
+        resp = await client.post(ai.TELEGRAM_WEBHOOK_PATH, data=update_body(first_id + n), headers=headers)
+        statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+    elapsed = time.perf_counter() - started
+    print(f"{label:<14} {REQUESTS / elapsed:8.0f} req/s  statuses {statuses}")
+    return statuses.get(403, 0)
+
+async def main() -> int:
+    ai.init_db()
+    application = ai.Application.builder().token(ai.UPLOAD_BOT_TOKEN).updater(None).build()
+    ai.telegram_app = application
+    app = NullApp(application.bot)
+    ai.dispatcher.start(app)
+    client = ai.app.test_client()
+
+    missing = await post_many(client, "no secret", None, 1)
+    wrong = await post_many(client, "wrong secret", "x" * len(ai.WEBHOOK_SECRET), REQUESTS + 1)
+    leaked = ai.dispatcher.metrics()["accepted"]
+    await post_many(client, "right secret", ai.WEBHOOK_SECRET, 2 * REQUESTS + 1)
+    await ai.dispatcher.stop(30)
+
+    counters = (await (await client.get("/metrics")).get_json())["webhook"]
+    print(f"webhook counters: {counters}")
+    print(f"updates processed: {app.processed} (expected {REQUESTS})")
+
+    ai.shutdown_db_executor()
+    ai.close_db_pool()
+    ok = (
+        missing == REQUESTS and wrong == REQUESTS
+        and counters["missing_secret"] == REQUESTS and counters["bad_secret"] == REQUESTS
+        and not any(leaked.values()) and app.processed == REQUESTS
+    )
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -971,12 +971,69 @@ def nmain():
 # --- Create Flask app ---
 from flask import Flask, request
 import asyncio
+from telegram.ext import BaseUpdateProcessor
 
 flask_app = Flask(__name__)
 
+# max updates handled at once (different users run concurrently, one user's updates in order)
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", 8))
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # concurrent across users, strictly in order per user (conversation state is per user).
+    # process_update is overridden so a user's queued updates wait on the user's lock
+    # *before* taking one of the max_concurrent_updates slots; otherwise one busy user
+    # could occupy every slot while its updates queue behind each other.
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: Dict[Any, asyncio.Lock] = {}
+        self._users: Dict[Any, int] = {}
+
+    async def process_update(self, update, coroutine) -> None:
+        if isinstance(update, Update) and update.effective_user is not None:
+            key = update.effective_user.id
+        elif isinstance(update, Update) and update.effective_chat is not None:
+            key = ("chat", update.effective_chat.id)
+        else:
+            async with self._slots:
+                await self.do_process_update(update, coroutine)
+            return
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._slots:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
 # Use the same token and handlers Application
 BOT_TOKEN = UPLOAD_BOT_TOKEN  # reuse your configured token
-app = ApplicationBuilder().token(BOT_TOKEN).build()
+app = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY)).build()
+
+# One event loop for the life of the process. The Application (and its HTTP
+# connection pool) lives on it; Flask request threads only hand updates over.
+bot_loop = asyncio.new_event_loop()
+
+
+def run_bot_loop():
+    asyncio.set_event_loop(bot_loop)
+    bot_loop.run_forever()
 
 # ---- Register all handlers (same as before) ----
 conv = ConversationHandler(
@@ -1012,9 +1069,10 @@ app.add_handler(CommandHandler("myinfo", cmd_myinfo))
 @flask_app.route(f"/webhook/{BOT_TOKEN}", methods=["POST"])
 def webhook():
     data = request.get_json()
-    print(f"📩 Update received: {data}", flush=True)
+    logger.debug("Update received: %s", data)
     update = Update.de_json(data, app.bot)
-    asyncio.run(app.process_update(update))
+    # queued for Application's update fetcher on the bot loop; ack Telegram right away
+    bot_loop.call_soon_threadsafe(app.update_queue.put_nowait, update)
     return "ok", 200
 
 
@@ -1035,9 +1093,10 @@ async def init_bot():
 def main():
     init_db()
     load_password_from_db()
-    asyncio.run(init_bot())
+    threading.Thread(target=run_bot_loop, name="bot-loop", daemon=True).start()
+    asyncio.run_coroutine_threadsafe(init_bot(), bot_loop).result()
     port = int(os.environ.get("PORT", 8080))
-    flask_app.run(host="0.0.0.0", port=port)
+    flask_app.run(host="0.0.0.0", port=port, threaded=True)
 
 
 if __name__ == "__main__":
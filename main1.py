@@ -899,9 +899,12 @@ async def cmd_myinfo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- Webhook setup for Render hosting ---
 
 import logging
-from flask import Flask, request
+import threading
+import concurrent.futures
+from flask import Flask, request, jsonify
 from telegram import Update
 import asyncio
+import signal
 
 # Create Flask app (Render exposes this via HTTPS)
 flask_app = Flask(__name__)
@@ -909,31 +912,130 @@ flask_app = Flask(__name__)
 # --- Create Telegram bot application ---
 application = ApplicationBuilder().token(UPLOAD_BOT_TOKEN).build()
 
+# max updates being processed on the background loop at once
+MAX_IN_FLIGHT_UPDATES = int(os.environ.get("MAX_IN_FLIGHT_UPDATES", 32))
+# how long a Flask thread waits for a free slot before answering 503 (Telegram retries later)
+DISPATCH_WAIT_SECONDS = float(os.environ.get("DISPATCH_WAIT_SECONDS", 5))
+
+
+class LoopDispatcher:
+    # runs coroutines from Flask request threads on one background loop; in-flight work is capped,
+    # and failures are logged and counted instead of dropped
+
+    def __init__(self, max_in_flight: int):
+        self.loop = asyncio.new_event_loop()
+        self.max_in_flight = max(1, max_in_flight)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closing = False
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_loop, name="telegram-loop", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro, timeout=None):
+        # setup/teardown: wait for the result
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def submit(self, coro, wait: float) -> bool:
+        # False if no slot freed up in time
+        if self._closing or not self._slots.acquire(timeout=wait):
+            coro.close()
+            with self._lock:
+                self.rejected += 1
+            return False
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._on_done)
+        return True
+
+    def _on_done(self, future):
+        self._slots.release()
+        with self._lock:
+            self._futures.discard(future)
+            if future.cancelled():
+                self.failed += 1
+                return
+            error = future.exception()
+            if error is None:
+                self.completed += 1
+                return
+            self.failed += 1
+        logging.error("Update processing failed", exc_info=error)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._futures)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._futures),
+                "max_in_flight": self.max_in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self, final=None, timeout: float = 30):
+        # refuse new work, drain in-flight updates, run `final` on the loop, then stop it
+        self._closing = True
+        with self._lock:
+            futures = list(self._futures)
+        _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            logging.warning("Cancelled %d updates still running at shutdown", len(not_done))
+        if self._thread is None:
+            if final is not None:
+                final.close()
+            return
+        if final is not None:
+            try:
+                self.run(final, timeout)
+            except Exception:
+                logging.exception("Error while shutting down the bot")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+
+dispatcher = LoopDispatcher(MAX_IN_FLIGHT_UPDATES)
 
-# --- Webhook route ---
-# @flask_app.route(f"/webhook/{UPLOAD_BOT_TOKEN}", methods=["POST"])
-# Create a global event loop for Telegram updates
-background_loop = asyncio.new_event_loop()
-asyncio.set_event_loop(background_loop)
 
+# --- Webhook route ---
 @flask_app.route(f"/webhook/{UPLOAD_BOT_TOKEN}", methods=["POST"])
 def webhook():
     """Handle incoming Telegram updates safely across requests"""
     try:
         data = request.get_json(force=True)
         update = Update.de_json(data, application.bot)
-
-        # Run coroutine in background loop without closing it
-        asyncio.run_coroutine_threadsafe(
-            application.process_update(update),
-            background_loop
-        )
     except Exception as e:
         logging.exception(f"Error in webhook: {e}")
+        return "OK", 200
 
+    if not dispatcher.submit(application.process_update(update), DISPATCH_WAIT_SECONDS):
+        return "busy", 503
     return "OK", 200
 
 
+@flask_app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify(dispatcher.stats())
 
 
 # --- Webhook setup ---
@@ -949,14 +1051,6 @@ async def setup_webhook():
     logging.info(f"✅ Webhook set: {webhook_url}")
 
 
-import threading
-
-def run_loop(loop):
-    asyncio.set_event_loop(loop)
-    loop.run_forever()
-
-threading.Thread(target=run_loop, args=(background_loop,), daemon=True).start()
-
 # --- Main entrypoint ---
 def main():
     """Main entrypoint (used by Render)"""
@@ -966,31 +1060,39 @@ def main():
     init_db()
     load_password_from_db()
 
-    # --- Step 2: Initialize bot & webhook using a fresh event loop ---
+    # --- Step 2: Start the background event loop and initialize the bot on it ---
+    # (the Application must live on the same loop that later processes updates)
     async def init_bot():
         await application.initialize()
         await application.start()
         await setup_webhook()
         logging.info("✅ Bot initialized and webhook set.")
 
-    asyncio.run(init_bot())  # <-- temporary loop just for setup
+    dispatcher.start()
+    dispatcher.run(init_bot())
 
     application.add_handler(CommandHandler("start", start))
-    # --- Step 3: Start background event loop for Telegram updates ---
-    def run_loop(loop):
-        asyncio.set_event_loop(loop)
-        loop.run_forever()
-
-    threading.Thread(target=run_loop, args=(background_loop,), daemon=True).start()
 
-    # --- Step 4: Run Flask server ---
+    # --- Step 3: Run Flask server ---
     port = int(os.environ.get("PORT", 8080))
     logging.info(f"🚀 Starting Flask server on port {port}")
-    flask_app.run(host="0.0.0.0", port=port)
+    # Render stops the service with SIGTERM; turn it into SystemExit so the drain below runs
+    def _on_sigterm(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    try:
+        flask_app.run(host="0.0.0.0", port=port)
+    finally:
+        async def stop_bot():
+            await application.stop()
+            await application.shutdown()
+
+        dispatcher.shutdown(final=stop_bot())
 
 
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()